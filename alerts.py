@@ -0,0 +1,177 @@
+"""
+alerts.py — avvisi di prezzo crypto valutati ad ogni tick.
+
+Gli avvisi attivi stanno in memoria, per simbolo, in un ThresholdBook
+(thresholds.py): gli "above" scattano con soglia <= prezzo, i "below" con
+soglia >= prezzo, e un tick costa O(log n + k) anche con moltissimi avvisi attivi.
+
+Un avviso passa da "active" a "triggered" con un UPDATE condizionato: se più
+worker ricevono lo stesso tick, solo uno lo notifica. Le email partono da un
+thread dedicato (coda in memoria), così il tick non aspetta l'SMTP.
+"""
+import queue
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from market import get_feed
+from models import PriceAlert, User, db
+from thresholds import ThresholdBook, claim_chunks
+from utility import send_mail
+
+ABOVE = "above"
+BELOW = "below"
+
+ACTIVE = "active"
+TRIGGERED = "triggered"
+
+
+class AlertIndex:
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self.symbols = {}
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def _symbol(self, symbol):
+        alerts = self.symbols.get(symbol)
+        if alerts is None:
+            alerts = self.symbols[symbol] = ThresholdBook()
+        return alerts
+
+    def sync(self):
+        """Carica gli avvisi attivi con id successivo all'ultimo visto (anche creati da altri worker)."""
+        t = PriceAlert.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(t.c.id, t.c.symbol, t.c.direction, t.c.threshold)
+                .where(t.c.id > self.last_id, t.c.status == ACTIVE)
+                .order_by(t.c.id)
+            ).all()
+        by_symbol = {}
+        for row in rows:
+            by_symbol.setdefault(row.symbol, []).append((row.id, row.threshold, row.direction == ABOVE, row.id))
+        for symbol, symbol_rows in by_symbol.items():
+            self._symbol(symbol).extend(symbol_rows)
+        if rows:
+            self.last_id = rows[-1].id
+        return len(rows)
+
+    def add(self, alert):
+        with self._lock:
+            self._symbol(alert.symbol).add(alert.id, alert.threshold, alert.direction == ABOVE, alert.id)
+
+    def discard(self, symbol, alert_id):
+        with self._lock:
+            alerts = self.symbols.get(symbol)
+            if alerts is not None:
+                alerts.discard(alert_id)
+
+    def on_tick(self, symbol, price, timestamp):
+        """Listener del PriceFeed: marca come scattati gli avvisi raggiunti e li mette in coda."""
+        with self._lock:
+            self.sync()
+            alerts = self.symbols.get(symbol)
+            crossed = alerts.pop_crossed(price) if alerts else []
+        if not crossed:
+            return 0
+        fired = claim(crossed, price, timestamp or datetime.now())
+        self.notifier.enqueue(fired, price)
+        return len(fired)
+
+    def active_count(self):
+        return sum(len(alerts) for alerts in self.symbols.values())
+
+
+def claim(alert_ids, price, now):
+    """active -> triggered; ritorna solo gli avvisi presi da questo processo, con l'email dell'utente."""
+    t = PriceAlert.__table__
+    users = User.__table__
+    fired = []
+    with db.engine.begin() as conn:
+        for ids in claim_chunks(conn, t, alert_ids, t.c.status == ACTIVE,
+                                status=TRIGGERED, triggered_at=now, triggered_price=price):
+            if ids:
+                fired.extend(conn.execute(
+                    db.select(t.c.id, t.c.symbol, t.c.direction, t.c.threshold, users.c.email)
+                    .join(users, users.c.id == t.c.user_id)
+                    .where(t.c.id.in_(ids))
+                ).all())
+    return fired
+
+
+class AlertNotifier(threading.Thread):
+    """Invia le email degli avvisi scattati; enqueue non blocca mai chi pubblica il tick."""
+
+    def __init__(self, app, maxsize=10000):
+        super().__init__(name="alert-notifier", daemon=True)
+        self.app = app
+        self.queue = queue.Queue(maxsize)
+        self._stopping = False
+
+    def enqueue(self, alerts, price):
+        dropped = 0
+        for alert in alerts:
+            try:
+                self.queue.put_nowait((alert, price))
+            except queue.Full:
+                dropped += 1
+        if dropped:
+            # l'avviso resta "triggered" e visibile nella pagina investimenti, manca solo l'email
+            self.app.logger.warning("Coda avvisi piena: %d notifiche scartate", dropped)
+
+    def deliver(self, alert, price):
+        verb = "sopra" if alert.direction == ABOVE else "sotto"
+        send_mail(
+            alert.email,
+            f"Avviso prezzo {alert.symbol.upper()}",
+            f"{alert.symbol.upper()} è a ${price:,.2f}, {verb} la soglia di ${alert.threshold:,.2f} che hai impostato.",
+        )
+
+    def run(self):
+        with self.app.app_context():
+            while not (self._stopping and self.queue.empty()):
+                try:
+                    alert, price = self.queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                try:
+                    self.deliver(alert, price)
+                except Exception as e:
+                    self.app.logger.warning("Invio avviso %s fallito: %s", alert.id, e)
+
+    def stop(self):
+        self._stopping = True
+
+
+def create_alert(user, symbol, direction, threshold):
+    """Salva un avviso e lo rende subito attivo nell'indice di questo worker."""
+    if direction not in (ABOVE, BELOW):
+        raise ValueError("Direzione non valida")
+    if threshold <= 0:
+        raise ValueError("La soglia deve essere positiva")
+    alert = PriceAlert(user_id=user.id, symbol=symbol, direction=direction, threshold=threshold)
+    db.session.add(alert)
+    db.session.commit()
+    get_index(current_app).add(alert)
+    return alert
+
+
+def delete_alert(alert):
+    get_index(current_app).discard(alert.symbol, alert.id)
+    db.session.delete(alert)
+    db.session.commit()
+
+
+def init_app(app):
+    notifier = AlertNotifier(app, app.config.get("ALERT_QUEUE_SIZE", 10000))
+    index = AlertIndex(notifier)
+    app.extensions["price_alerts"] = index
+    app.extensions.setdefault("background_workers", []).append(notifier)
+    get_feed(app).subscribe(index.on_tick)
+    return index
+
+
+def get_index(app):
+    return app.extensions["price_alerts"]
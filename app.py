@@ -1,24 +1,105 @@
-import os
+import atexit
 from flask import Flask
-from models import db
+from models import db, upgrade_schema
 from config import Config
 import routes
+import search
+import health
+import fx
+import audit
+import alerts
+import backfill
+import fixtures
+import cards
+import market
+import trading
+import risk
+import sessions
+import caching
+import warmup
 import utility
 
 #-----------------------------
-# App configuration
+# App factory
 #-----------------------------
-app = Flask(__name__)
-app.config.from_object(Config)
+def create_app(config_object=Config, start_background=False):
+    """
+    Crea e configura l'applicazione senza avviare i thread in background (refresher
+    FX, poller prezzi, audit, ...): li avviano solo i processi che servono richieste
+    (__main__ qui sotto, wsgi.py, post_fork di gunicorn), mai i comandi CLI come
+    seed-data o db-snapshot restore, che riscrivono il database.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    app.extensions["background_workers"] = []
 
-db.init_app(app)
+    db.init_app(app)
+
+    sessions.init_app(app)
+
+    routes.init_app(app)
+
+    health.init_app(app)
+
+    caching.init_app(app)
+
+    warmup.init_app(app)
+
+    fx.init_app(app)
+
+    audit.init_app(app)
+
+    backfill.init_app(app)
+
+    fixtures.init_app(app)
+
+    risk.init_app(app)
+
+    cards.init_app(app)
+
+    market.init_app(app)
+
+    trading.init_app(app)
+
+    alerts.init_app(app)
+
+    if start_background:
+        start_background_workers(app)
+    return app
+
+
+def init_db(app):
+    """Crea le tabelle e le colonne mancanti (da eseguire una sola volta, prima di avviare i worker)."""
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        search.init_db()
+        backfill.init_db()
+
+
+def start_background_workers(app):
+    for worker in app.extensions["background_workers"]:
+        if not worker.is_alive():
+            worker.start()
+    atexit.register(stop_background_workers, app)
+
+
+def stop_background_workers(app, timeout=5):
+    """Ferma i thread in background e segnala a /readyz che il processo sta chiudendo."""
+    app.extensions["shutting_down"] = True
+    workers = app.extensions["background_workers"]
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.is_alive():
+            worker.join(timeout)
 
-routes.init_app(app)
 
 #-----------------------------
-# Run the app
+# Run the app (solo sviluppo, per la produzione vedi wsgi.py)
 #-----------------------------
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
+    app = create_app()
+    init_db(app)
+    start_background_workers(app)
     app.run(debug=True)
@@ -0,0 +1,324 @@
+"""
+audit.py — log append-only degli eventi di sicurezza.
+
+Le route chiamano record_event(...), che mette l'evento in un buffer in memoria
+(un append su deque, nessun I/O). Un thread in background svuota il buffer a
+batch verso i sink configurati (AUDIT_SINKS):
+    "db"      — tabella AuditEvent, interrogabile per utente/intervallo di tempo
+    "ndjson"  — segmenti NDJSON a rotazione in instance/audit (un file per processo)
+
+Comandi CLI:
+    flask --app app audit-query --user 3 --since 2026-01-01
+    flask --app app audit-replay [--source ndjson] [--dry-run]
+"""
+import atexit
+import glob
+import heapq
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+import click
+from flask import current_app, has_request_context, request
+
+from cards import next_state_version
+from models import AuditEvent, Card, User, db
+
+
+class NdjsonSegmentWriter:
+    """Scrive eventi su file NDJSON, passando a un nuovo segmento oltre max_bytes."""
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pid = os.getpid()
+        self.seq = 0
+        self._file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_next(self):
+        if self._file:
+            self._file.close()
+        self.seq += 1
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        path = os.path.join(self.directory, f"events-{stamp}-{self.pid}-{self.seq:04d}.ndjson")
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, events):
+        if self._file is None or self._file.tell() >= self.max_bytes:
+            self._open_next()
+        self._file.write("".join(json.dumps(e, default=str) + "\n" for e in events))
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class AuditLog:
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config.get("AUDIT_BATCH_SIZE", 200)
+        self.flush_interval = app.config.get("AUDIT_FLUSH_INTERVAL", 2.0)
+        self.sinks = [s.strip() for s in app.config.get("AUDIT_SINKS", "db").split(",") if s.strip()]
+        self.segment_dir = app.config.get("AUDIT_SEGMENT_DIR") or os.path.join(app.instance_path, "audit")
+        self._buffer = deque()
+        self._pending = {}  # sink -> eventi di un flush fallito, riscritti al prossimo giro
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._writer = None
+        self.flusher = None
+
+    def record(self, type, user_id=None, ip=None, **data):
+        self._buffer.append({
+            "timestamp": datetime.now(),
+            "user_id": user_id,
+            "type": type,
+            "ip": ip,
+            "data": data,
+        })
+        if len(self._buffer) >= self.batch_size:
+            if self.flusher is not None and self.flusher.is_alive():
+                self._wake.set()
+            else:
+                # nessun flusher attivo (CLI, test): scrive subito per non perdere eventi.
+                # Un sink non disponibile non deve far fallire la richiesta: gli eventi
+                # restano in _pending e vengono riscritti al prossimo flush o alla chiusura
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.app.logger.warning("Scrittura audit log fallita, %d eventi in attesa di riprova: %s",
+                                            self.pending_count(), e)
+
+    def _write(self, sink, events):
+        if sink == "db":
+            rows = [dict(e, data=json.dumps(e["data"], default=str) if e["data"] else None) for e in events]
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(AuditEvent.__table__.insert(), rows)
+        elif sink == "ndjson":
+            if self._writer is None:
+                self._writer = NdjsonSegmentWriter(
+                    self.segment_dir, self.app.config.get("AUDIT_SEGMENT_BYTES", 16 * 1024 * 1024))
+            self._writer.write(events)
+
+    def flush(self):
+        """
+        Scrive tutti gli eventi in buffer in un unico batch per sink; ritorna quanti ne ha presi.
+        Se un sink fallisce (es. "database is locked") i suoi eventi restano in attesa,
+        in ordine, e vengono riscritti al flush successivo prima di quelli nuovi; gli
+        altri sink non li ricevono due volte. L'errore viene comunque propagato.
+        """
+        with self._flush_lock:
+            batch = []
+            while self._buffer:
+                batch.append(self._buffer.popleft())
+            error = None
+            for sink in self.sinks:
+                events = self._pending.pop(sink, []) + batch
+                if not events:
+                    continue
+                try:
+                    self._write(sink, events)
+                except Exception as e:
+                    self._pending[sink] = events
+                    error = error or e
+            if error is not None:
+                raise error
+            return len(batch)
+
+    def pending_count(self):
+        return len(self._buffer) + sum(len(events) for events in self._pending.values())
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # ultimo tentativo alla chiusura: se il sink NDJSON non è configurato, quello che
+            # il database non ha preso finisce in un segmento (audit-replay --source ndjson)
+            lost = self._pending.get("db")
+            if lost and "ndjson" not in self.sinks:
+                try:
+                    self._write("ndjson", lost)
+                    del self._pending["db"]
+                    self.app.logger.error("Audit log: %d eventi salvati solo in %s (%s)",
+                                          len(lost), self.segment_dir, e)
+                except OSError:
+                    pass
+            if self._pending:
+                self.app.logger.error("Audit log: %d eventi non scritti alla chiusura", self.pending_count())
+        if self._writer:
+            self._writer.close()
+
+
+class AuditFlusher(threading.Thread):
+    """Svuota il buffer ogni flush_interval secondi, o prima se si riempie un batch."""
+
+    def __init__(self, log):
+        super().__init__(name="audit-flusher", daemon=True)
+        self.log = log
+        self._stopping = False
+
+    def run(self):
+        while not self._stopping:
+            self.log._wake.wait(self.log.flush_interval)
+            self.log._wake.clear()
+            try:
+                self.log.flush()
+            except Exception as e:
+                self.log.app.logger.warning("Scrittura audit log fallita, %d eventi in attesa di riprova: %s",
+                                            self.log.pending_count(), e)
+        self.log.close()
+
+    def stop(self):
+        self._stopping = True
+        self.log._wake.set()
+        if not self.is_alive():
+            # thread mai avviato (es. master gunicorn): svuota comunque il buffer
+            self.log.close()
+
+
+def record_event(type, user_id=None, **data):
+    """Registra un evento di audit; costo sul percorso della richiesta: un append in memoria."""
+    ip = request.remote_addr if has_request_context() else None
+    current_app.extensions["audit"].record(type, user_id=user_id, ip=ip, **data)
+
+
+# -----------------------------
+# Query e replay
+# -----------------------------
+
+def query_events(user_id=None, since=None, until=None, types=None, limit=100):
+    """Eventi più recenti per primi, tramite l'indice (user_id, timestamp)."""
+    query = AuditEvent.query
+    if user_id is not None:
+        query = query.filter(AuditEvent.user_id == user_id)
+    if since is not None:
+        query = query.filter(AuditEvent.timestamp >= since)
+    if until is not None:
+        query = query.filter(AuditEvent.timestamp < until)
+    if types:
+        query = query.filter(AuditEvent.type.in_(types))
+    return query.order_by(AuditEvent.timestamp.desc(), AuditEvent.id.desc()).limit(limit).all()
+
+
+def iter_events_db(batch=5000):
+    last_id = 0
+    while True:
+        rows = AuditEvent.query.filter(AuditEvent.id > last_id).order_by(AuditEvent.id).limit(batch).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row.to_dict()
+        last_id = rows[-1].id
+
+
+def iter_events_ndjson(directory):
+    """Unisce i segmenti di tutti i processi in ordine di timestamp (ogni file è già ordinato)."""
+    def read(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    paths = sorted(glob.glob(os.path.join(directory, "events-*.ndjson")))
+    return heapq.merge(*(read(p) for p in paths), key=lambda e: e["timestamp"])
+
+
+def _parse_ts(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def replay(events):
+    """
+    Ricostruisce lo stato derivato dagli eventi: blocco carte, tentativi di login
+    falliti e lock degli account. Ritorna (cards, users) con lo stato atteso.
+    """
+    cards = {}  # card_id -> blocked
+    users = {}  # user_id -> {"failed_attempts": n, "locked_until": dt | None}
+    for e in events:
+        t = e["type"]
+        data = e.get("data") or {}
+        if t in ("card_blocked", "card_unblocked"):
+            cards[data["card_id"]] = t == "card_blocked"
+        elif t in ("login_failed", "login_succeeded", "account_locked"):
+            state = users.setdefault(e["user_id"], {"failed_attempts": 0, "locked_until": None})
+            if t == "login_failed":
+                state["failed_attempts"] = data.get("attempts", state["failed_attempts"] + 1)
+            elif t == "login_succeeded":
+                state["failed_attempts"] = 0
+            else:
+                state["locked_until"] = _parse_ts(data["locked_until"])
+    return cards, users
+
+
+def apply_replay(cards, users):
+    """
+    Allinea Card e User allo stato ricostruito; ritorna il numero di righe cambiate.
+    Le carte cambiate ricevono una nuova state_version, come in cards.set_card_blocked:
+    i worker in esecuzione vedono il blocco al prossimo controllo dell'indice carte.
+    """
+    changed = 0
+    for card_id, blocked in cards.items():
+        card = db.session.get(Card, card_id)
+        if card is not None and bool(card.blocked) != blocked:
+            card.blocked = blocked
+            card.state_version = next_state_version()
+            if not blocked:
+                card.cvv_failures = 0
+            changed += 1
+    for user_id, state in users.items():
+        user = db.session.get(User, user_id)
+        if user is None:
+            continue
+        if user.failed_attempts != state["failed_attempts"] or user.locked_until != state["locked_until"]:
+            user.failed_attempts = state["failed_attempts"]
+            user.locked_until = state["locked_until"]
+            changed += 1
+    return changed
+
+
+@click.command("audit-query")
+@click.option("--user", "user_id", type=int)
+@click.option("--since", type=click.DateTime())
+@click.option("--until", type=click.DateTime())
+@click.option("--type", "types", multiple=True)
+@click.option("--limit", default=50)
+def audit_query_command(user_id, since, until, types, limit):
+    """Mostra gli eventi di audit filtrati per utente e intervallo di tempo."""
+    current_app.extensions["audit"].flush()
+    for e in query_events(user_id, since, until, types, limit):
+        click.echo(json.dumps(e.to_dict(), ensure_ascii=False))
+
+
+@click.command("audit-replay")
+@click.option("--source", type=click.Choice(["db", "ndjson"]), default="db")
+@click.option("--dry-run", is_flag=True, help="mostra le differenze senza salvarle")
+def audit_replay_command(source, dry_run):
+    """Ricostruisce blocco carte e lock degli account rileggendo il log di audit."""
+    log = current_app.extensions["audit"]
+    log.flush()
+    events = iter_events_db() if source == "db" else iter_events_ndjson(log.segment_dir)
+    cards, users = replay(events)
+    changed = apply_replay(cards, users)
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    click.echo(f"{len(cards)} carte, {len(users)} utenti nel log; {changed} righe "
+               f"{'da aggiornare' if dry_run else 'aggiornate'}.")
+
+
+def init_app(app):
+    log = AuditLog(app)
+    log.flusher = AuditFlusher(log)
+    app.extensions["audit"] = log
+    app.extensions.setdefault("background_workers", []).append(log.flusher)
+    # processi senza flusher (CLI, script): il buffer sotto AUDIT_BATCH_SIZE viene scritto all'uscita
+    atexit.register(log.close)
+    app.cli.add_command(audit_query_command)
+    app.cli.add_command(audit_replay_command)
+    return log
@@ -0,0 +1,292 @@
+"""
+backfill.py — import/export massivo dello storico prezzi (CryptoPriceHistory).
+
+Formati (scelti dall'estensione o con --format):
+    csv      — intestazione symbol,timestamp,price; timestamp ISO 8601
+    parquet  — colonne symbol (string), timestamp (timestamp[us]), price (double);
+               richiede pyarrow, letto e scritto a record batch
+    bin      — dump binario a record fissi, letto via mmap senza caricarlo in memoria:
+               MAGIC, poi record "<32sqd" = symbol (fino a 32 byte, UTF-8 con padding \\0),
+               microsecondi dal 1970-01-01 (ora locale naive, come nel DB), prezzo.
+               Si leggono anche i dump della versione 1 (symbol su 10 byte).
+
+I timestamp con fuso orario (CSV "...+00:00", parquet timestamp[us, tz]) vengono
+convertiti nell'ora locale naive usata dal database, così l'indice unico
+riconosce i doppioni.
+
+Le righe vengono lette e inserite a blocchi di --chunk-size, un blocco per
+transazione con un solo executemany sul driver sqlite3, con il timestamp già nel
+formato testuale che SQLAlchemy usa per DateTime (senza il costo dei bind processor).
+Per il dump binario i record passano così come escono da struct.iter_unpack:
+symbol e timestamp vengono convertiti da SQLite stesso. I doppioni (stesso symbol e timestamp, già
+presenti o ripetuti nel file) vengono scartati dal database grazie all'indice
+unico ux_crypto_price_symbol_ts (INSERT ... ON CONFLICT DO NOTHING).
+
+I dati importati sono storici: non passano dal PriceFeed, quindi non eseguono
+ordini limit né fanno scattare avvisi.
+
+Comandi CLI:
+    flask --app app prices-import storico.csv [--chunk-size 50000]
+    flask --app app prices-export dump.bin --symbol bitcoin --since 2026-01-01
+"""
+import csv
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+import click
+
+from models import db
+
+FORMATS = ("csv", "parquet", "bin")
+MAGIC = b"BFPH\x00\x02\x00\x00"
+RECORD = struct.Struct("<32sqd")
+RECORDS = {MAGIC: RECORD, b"BFPH\x00\x01\x00\x00": struct.Struct("<10sqd")}  # versione -> record
+SYMBOL_BYTES = 32
+EPOCH = datetime(1970, 1, 1)
+UNIQUE_INDEX = "ux_crypto_price_symbol_ts"
+
+INSERT_SQL = """INSERT INTO crypto_price_history (symbol, timestamp, price) VALUES (?, ?, ?)
+                ON CONFLICT (symbol, timestamp) DO NOTHING"""
+# record binari (symbol bytes, microsecondi, prezzo) -> stesse colonne testuali di INSERT_SQL
+INSERT_BIN_SQL = """INSERT INTO crypto_price_history (symbol, timestamp, price)
+                    VALUES (CAST(CASE WHEN instr(?1, x'00') THEN substr(?1, 1, instr(?1, x'00') - 1) ELSE ?1 END AS TEXT),
+                            strftime('%Y-%m-%d %H:%M:%S', ?2 / 1000000, 'unixepoch') || printf('.%06d', ?2 % 1000000),
+                            ?3)
+                    ON CONFLICT (symbol, timestamp) DO NOTHING"""
+
+
+def init_db():
+    """
+    Crea l'indice unico anche sui database esistenti (create_all non tocca le
+    tabelle già create), eliminando prima gli eventuali doppioni.
+    """
+    with db.engine.begin() as conn:
+        if conn.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name=:name"
+        ), {"name": UNIQUE_INDEX}).first() is not None:
+            return
+        # l'indice su symbol da solo è un prefisso di quello unico: rallenterebbe solo gli insert
+        conn.execute(db.text("DROP INDEX IF EXISTS ix_crypto_price_history_symbol"))
+        conn.execute(db.text(
+            """DELETE FROM crypto_price_history WHERE id NOT IN (
+                   SELECT MIN(id) FROM crypto_price_history GROUP BY symbol, timestamp)"""
+        ))
+        conn.execute(db.text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX} ON crypto_price_history (symbol, timestamp)"
+        ))
+
+
+def detect_format(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise click.ClickException(f"Formato non riconosciuto per {path}: usa --format {'/'.join(FORMATS)}")
+    return fmt
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _micros(ts):
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise click.ClickException("Il formato parquet richiede pyarrow (pip install pyarrow).") from None
+    return pyarrow
+
+
+# -----------------------------
+# Lettura (a blocchi di tuple pronte per l'executemany)
+# -----------------------------
+
+def db_timestamp(ts):
+    # stesso formato che SQLAlchemy usa per DateTime su SQLite, così l'indice unico riconosce i doppioni
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts.isoformat(" ", "microseconds")
+
+
+def read_csv(path, chunk_size):
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != ["symbol", "timestamp", "price"]:
+            raise click.ClickException(f"{path}: intestazione attesa symbol,timestamp,price")
+        rows = ((s, db_timestamp(datetime.fromisoformat(ts)), float(p)) for s, ts, p in reader)
+        yield from _chunks(rows, chunk_size)
+
+
+def read_parquet(path, chunk_size):
+    pa = _pyarrow()
+    for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size,
+                                                           columns=["symbol", "timestamp", "price"]):
+        cols = batch.to_pydict()
+        yield [(s, db_timestamp(ts), p) for s, ts, p in zip(cols["symbol"], cols["timestamp"], cols["price"])]
+
+
+def read_bin(path, chunk_size):
+    with open(path, "rb") as f:
+        record = RECORDS.get(f.read(len(MAGIC)))
+        if record is None:
+            raise click.ClickException(f"{path}: intestazione non valida")
+        size = os.fstat(f.fileno()).st_size
+        if (size - len(MAGIC)) % record.size:
+            raise click.ClickException(f"{path}: dimensione non valida per un dump binario")
+        if size == len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                step = chunk_size * record.size
+                for start in range(len(MAGIC), size, step):
+                    yield list(record.iter_unpack(view[start:start + step]))
+            finally:
+                view.release()
+
+
+READERS = {"csv": (read_csv, INSERT_SQL), "parquet": (read_parquet, INSERT_SQL), "bin": (read_bin, INSERT_BIN_SQL)}
+
+
+# -----------------------------
+# Scrittura
+# -----------------------------
+
+def write_csv(path, chunks):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["symbol", "timestamp", "price"])
+        for chunk in chunks:
+            writer.writerows((s, ts.isoformat(), repr(p)) for s, ts, p in chunk)
+
+
+def write_parquet(path, chunks):
+    pa = _pyarrow()
+    schema = pa.schema([("symbol", pa.string()), ("timestamp", pa.timestamp("us")), ("price", pa.float64())])
+    with pa.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            symbols, stamps, prices = zip(*chunk)
+            writer.write_batch(pa.record_batch([list(symbols), list(stamps), list(prices)], schema=schema))
+
+
+def _symbol_bytes(symbol):
+    # struct tronca in silenzio i campi "s" troppo lunghi: meglio fermare l'export
+    encoded = symbol.encode()
+    if len(encoded) > SYMBOL_BYTES:
+        raise click.ClickException(f"Simbolo troppo lungo per il formato bin ({SYMBOL_BYTES} byte): {symbol}")
+    return encoded
+
+
+def write_bin(path, chunks):
+    pack = RECORD.pack
+    symbols = {}  # pochi simboli distinti: codificati e controllati una volta sola
+
+    def encode(symbol):
+        encoded = symbols.get(symbol)
+        if encoded is None:
+            encoded = symbols[symbol] = _symbol_bytes(symbol)
+        return encoded
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        for chunk in chunks:
+            f.write(b"".join(pack(encode(s), _micros(ts), p) for s, ts, p in chunk))
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet, "bin": write_bin}
+
+
+# -----------------------------
+# Import / export
+# -----------------------------
+
+def import_prices(path, fmt=None, chunk_size=50000, progress=None):
+    """Importa un file di prezzi; ritorna (righe lette, righe inserite)."""
+    init_db()
+    reader, sql = READERS[detect_format(path, fmt)]
+    read, inserted = 0, 0
+    for chunk in reader(path, chunk_size):
+        with db.engine.begin() as conn:
+            inserted += conn.exec_driver_sql(sql, chunk).rowcount
+        read += len(chunk)
+        if progress:
+            progress(read, inserted)
+    return read, inserted
+
+
+def iter_prices(symbol=None, since=None, until=None, chunk_size=50000):
+    """Storico ordinato per (symbol, timestamp), a blocchi di tuple, senza caricarlo tutto in memoria."""
+    where, params = [], []
+    for clause, value in (("symbol = ?", symbol), ("timestamp >= ?", since), ("timestamp < ?", until)):
+        if value:
+            where.append(clause)
+            params.append(db_timestamp(value) if isinstance(value, datetime) else value)
+    sql = "SELECT symbol, timestamp, price FROM crypto_price_history"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY symbol, timestamp"
+    parse = datetime.fromisoformat
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).exec_driver_sql(sql, tuple(params))
+        for chunk in result.partitions(chunk_size):
+            yield [(s, parse(ts), p) for s, ts, p in chunk]
+
+
+def export_prices(path, fmt=None, symbol=None, since=None, until=None, chunk_size=50000):
+    """Esporta lo storico nel formato richiesto; ritorna il numero di righe scritte."""
+    written = 0
+
+    def counted():
+        nonlocal written
+        for chunk in iter_prices(symbol, since, until, chunk_size):
+            written += len(chunk)
+            yield chunk
+
+    WRITERS[detect_format(path, fmt)](path, counted())
+    return written
+
+
+@click.command("prices-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS))
+@click.option("--chunk-size", default=50000, show_default=True)
+def prices_import_command(path, fmt, chunk_size):
+    """Importa lo storico prezzi da PATH, saltando le righe già presenti."""
+    started = time.perf_counter()
+    read, inserted = import_prices(
+        path, fmt, chunk_size, progress=lambda r, i: click.echo(f"\r{r:,} righe lette, {i:,} inserite", nl=False))
+    elapsed = time.perf_counter() - started
+    click.echo(f"\r{read:,} righe lette, {inserted:,} inserite, {read - inserted:,} già presenti "
+               f"in {elapsed:.1f}s ({read / max(elapsed, 1e-9):,.0f} righe/s)")
+
+
+@click.command("prices-export")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(FORMATS))
+@click.option("--symbol")
+@click.option("--since", type=click.DateTime())
+@click.option("--until", type=click.DateTime())
+@click.option("--chunk-size", default=50000, show_default=True)
+def prices_export_command(path, fmt, symbol, since, until, chunk_size):
+    """Esporta lo storico prezzi in PATH (stesso formato letto da prices-import)."""
+    started = time.perf_counter()
+    written = export_prices(path, fmt, symbol, since, until, chunk_size)
+    click.echo(f"{written:,} righe esportate in {path} in {time.perf_counter() - started:.1f}s")
+
+
+def init_app(app):
+    app.cli.add_command(prices_import_command)
+    app.cli.add_command(prices_export_command)
@@ -0,0 +1,93 @@
+"""
+card_auth.py — throughput delle autorizzazioni carta.
+
+Crea un database SQLite temporaneo con N utenti/carte e misura:
+    - check: solo verifica della carta sull'indice in memoria (nessuna scrittura)
+    - http:  POST /api/cards/authorize completo (verifica + antifrode + addebito)
+    - batch di carte bloccate a metà run per verificare l'invalidazione
+
+Uso (dalla root del progetto):
+    python benchmarks/card_auth.py --cards 10000 --checks 200000 --requests 3000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def setup(app, n_cards):
+    from models import Card, User, db
+
+    rng = random.Random(42)
+    users = [{"id": i, "name": f"user{i}", "email": f"user{i}@bench.local", "password": "x",
+              "balance": 1_000_000.0, "iban": f"IT{i:025d}", "currency": "EUR"} for i in range(1, n_cards + 1)]
+    cards = [{"id": i, "number": f"4{i:015d}", "expiry": "12/35", "cvv": f"{rng.randrange(1000):03d}",
+              "user_id": i, "blocked": False, "state_version": 0} for i in range(1, n_cards + 1)]
+    with app.app_context():
+        db.session.execute(db.insert(User), users)
+        db.session.execute(db.insert(Card), cards)
+        db.session.commit()
+    return cards
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=3000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja_cache"),
+        "FX_REFRESH_ENABLED": "0",
+        "CARD_TERMINAL_KEY": "bench",
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench",
+    })
+    from app import create_app, init_db
+    from cards import APPROVED, BLOCKED, get_index, set_card_blocked
+    from models import Card, db
+
+    app = create_app(start_background=False)
+    init_db(app)
+    cards = setup(app, args.cards)
+    rng = random.Random(7)
+
+    with app.app_context():
+        index = get_index(app)
+        start = time.perf_counter()
+        index.load()
+        print(f"caricamento indice: {args.cards} carte in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        sample = [rng.choice(cards) for _ in range(args.checks)]
+        start = time.perf_counter()
+        approved = sum(1 for c in sample if index.check(c["number"], c["expiry"], c["cvv"])[0] == APPROVED)
+        elapsed = time.perf_counter() - start
+        print(f"check:  {args.checks / elapsed:>10,.0f} aut/s  ({approved}/{args.checks} approvate)")
+
+        blocked = cards[0]
+        set_card_blocked(index, db.session.get(Card, blocked["id"]), True)
+        code = index.check(blocked["number"], blocked["expiry"], blocked["cvv"])[0]
+        print(f"carta bloccata -> codice {code} ({'OK' if code == BLOCKED else 'ERRORE'})")
+
+    client = app.test_client()
+    start = time.perf_counter()
+    approved = 0
+    for _ in range(args.requests):
+        c = rng.choice(cards[1:])
+        r = client.post("/api/cards/authorize", json={
+            "number": c["number"], "expiry": c["expiry"], "cvv": c["cvv"],
+            "amount": round(rng.uniform(1, 50), 2), "merchant": "bench"}, headers={"X-Terminal-Key": "bench"})
+        approved += r.get_json()["approved"]
+    elapsed = time.perf_counter() - start
+    print(f"http:   {args.requests / elapsed:>10,.0f} aut/s  ({approved}/{args.requests} approvate, con addebito)")
+
+
+if __name__ == "__main__":
+    main()
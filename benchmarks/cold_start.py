@@ -0,0 +1,97 @@
+"""
+cold_start.py — misura l'avvio a freddo di un worker: tempo di import di `app`
+e latenza della prima richiesta, con la bytecode cache dei template vuota (cache
+miss) o popolata da `flask precompile-templates` come al deploy (cache hit).
+
+Ogni misura gira in un processo Python nuovo (come un worker appena riciclato, senza
+preload) su un database SQLite temporaneo. Esce con codice 1 se il worker con cache
+hit supera il target.
+
+Uso (dalla root del progetto):
+    python benchmarks/cold_start.py --runs 5 --target-ms 800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+from app import create_app, init_db
+app = create_app(start_background=False)
+t1 = time.perf_counter()
+init_db(app)
+client = app.test_client()
+t2 = time.perf_counter()
+client.get("/")
+t3 = time.perf_counter()
+client.get("/login")
+t4 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first": t3 - t2, "second_page": t4 - t3}))
+"""
+
+
+def run_probe(env):
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(runs, workdir):
+    """Giri alternati miss/hit, così il rumore della macchina pesa uguale sulle due modalità."""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "FX_REFRESH_ENABLED": "0",
+        "SECRET_KEY": env.get("SECRET_KEY") or "bench",
+    })
+    hit_env = dict(env, TEMPLATE_CACHE_DIR=os.path.join(workdir, "jinja_cache"))
+    # passo di deploy: popola la bytecode cache su disco
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "precompile-templates"],
+                   cwd=ROOT, env=hit_env, capture_output=True, check=True)
+    samples = {False: [], True: []}
+    for i in range(runs):
+        miss_env = dict(env, TEMPLATE_CACHE_DIR=os.path.join(workdir, f"empty_{i}"))  # cache vuota ad ogni giro
+        samples[False].append(run_probe(miss_env))
+        samples[True].append(run_probe(hit_env))
+    return {
+        cache_hit: {k: statistics.median(s[k] for s in runs_) * 1000 for k in runs_[0]}
+        for cache_hit, runs_ in samples.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=800.0,
+                        help="budget per import + prima richiesta (mediana, cache hit)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = measure(args.runs, workdir)
+
+    print(f"{'cache':<14}{'import':>10}{'1a richiesta':>14}{'2a pagina':>12}{'totale':>10}")
+    for cache_hit, r in results.items():
+        total = r["import"] + r["first"]
+        label = "hit" if cache_hit else "miss"
+        print(f"{label:<14}{r['import']:>8.1f}ms{r['first']:>12.1f}ms{r['second_page']:>10.1f}ms{total:>8.1f}ms")
+
+    if results[True]["first"] > results[False]["first"]:
+        print("FAIL: la prima richiesta con cache hit non è più veloce che con cache miss")
+        return 1
+    total = results[True]["import"] + results[True]["first"]
+    if total > args.target_ms:
+        print(f"FAIL: avvio a freddo {total:.1f} ms > target {args.target_ms:.0f} ms")
+        return 1
+    print(f"OK: avvio a freddo {total:.1f} ms <= target {args.target_ms:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+caching.py — header di cache e GET condizionali.
+
+- File statici: url_for('static', ...) aggiunge ?v=<hash contenuto>, quindi le
+  risposte versionate possono avere una scadenza di un anno (immutable).
+- Pagine: il decoratore @conditional calcola un ETag a partire da un validatore
+  economico (es. id dell'ultima Transaction + saldo) e risponde 304 senza
+  renderizzare il template se il client ha già quella versione.
+"""
+import hashlib
+import os
+from functools import wraps
+
+from flask import Response, current_app, make_response, request, session
+from werkzeug.utils import safe_join
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StaticVersioner:
+    """Hash dei file statici, calcolato una volta per processo (ricalcolato su mtime in debug)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._cache = {}  # filename -> (mtime, digest)
+
+    def version(self, filename):
+        cached = self._cache.get(filename)
+        if cached and not self.app.debug:
+            return cached[1]
+        path = safe_join(self.app.static_folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        mtime = os.path.getmtime(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        digest = _file_digest(path)[:12]
+        self._cache[filename] = (mtime, digest)
+        return digest
+
+
+def _asset_version(app):
+    """Impronta di template e statici: cambia ad ogni deploy e invalida tutti gli ETag delle pagine."""
+    h = hashlib.sha256()
+    for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for root, _dirs, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, app.root_path).encode())
+                h.update(_file_digest(path).encode())
+    return h.hexdigest()[:16]
+
+
+def conditional(validator):
+    """
+    Decoratore per le pagine GET. validator() ritorna la chiave di versione oppure None
+    per lasciare la gestione alla vista (utente non loggato, redirect, ecc.).
+    Con messaggi flash in attesa la pagina viene sempre renderizzata.
+
+    Solo ETag, niente Last-Modified: la chiave cambia anche senza nuovi movimenti
+    (carta bloccata, valuta, saldo), quindi una data non basta a dire che la
+    pagina non è cambiata.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+                return view(*args, **kwargs)
+            key = validator()
+            if key is None:
+                return view(*args, **kwargs)
+            raw = repr((current_app.extensions["asset_version"], request.full_path, session.get("user_id"), key))
+            etag = hashlib.sha1(raw.encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # pagine personali: la cache del browser può tenerle ma deve sempre rivalidarle
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add("Cookie")
+            return response
+        return wrapped
+    return decorator
+
+
+def init_app(app):
+    versioner = StaticVersioner(app)
+    app.extensions["asset_version"] = _asset_version(app)
+
+    @app.url_defaults
+    def _static_version(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            version = versioner.version(values["filename"])
+            if version:
+                values["v"] = version
+
+    @app.after_request
+    def _static_cache_headers(response):
+        # immutable solo se ?v= è l'hash del file servito da questo processo: durante un
+        # rolling deploy un worker vecchio non deve fissare per un anno il CSS vecchio
+        # sotto l'URL nuovo (e un ?v= qualsiasi resta no-cache)
+        if request.endpoint != "static" or response.status_code not in (200, 304):
+            return response
+        requested = request.args.get("v")
+        if requested and requested == versioner.version((request.view_args or {}).get("filename", "")):
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
+
+    return versioner
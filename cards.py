@@ -0,0 +1,262 @@
+"""
+cards.py — autorizzazione dei pagamenti con carta (POS/ATM simulati).
+
+Lo stato delle carte è tenuto in memoria in un dizionario indicizzato per
+HMAC-SHA256 del numero (i PAN non restano in chiaro come chiavi): una
+autorizzazione non passa dall'ORM, fa un lookup per chiave e, se approvata,
+un solo addebito atomico con SQL Core.
+
+Coerenza tra worker: emissione e block/unblock assegnano a Card.state_version
+un valore crescente; le autorizzazioni confrontano max(state_version) (lettura
+su indice) con l'ultimo visto, al più ogni CARD_STATE_MAX_STALENESS secondi, e
+ricaricano solo le carte cambiate. Nel worker che esegue il blocco l'effetto è
+immediato. I numeri sconosciuti restano in una cache negativa per UNKNOWN_TTL
+secondi, così chi prova numeri a caso non genera una query per tentativo.
+
+Tentativi su scadenza e CVV: una scadenza o un CVV errati danno la stessa risposta
+(N7), così chi conosce il PAN non può indovinare la scadenza e poi il CVV, e
+incrementano lo stesso contatore Card.cvv_failures (condiviso tra i worker); al
+raggiungimento di CARD_MAX_CVV_FAILURES la carta viene bloccata e va sbloccata
+dal titolare. Un'autorizzazione approvata azzera il contatore.
+
+Codici risposta (stile ISO 8583):
+    00 approvata            14 carta inesistente   54 carta scaduta
+    62 carta bloccata       N7 scadenza/CVV errati 51 fondi insufficienti
+    59 sospetta frode       13 importo non valido
+"""
+import hashlib
+import hmac
+import threading
+import time
+from datetime import datetime
+
+from models import Card, Transaction, db
+from utility import change_balance
+
+APPROVED = "00"
+INVALID_CARD = "14"
+EXPIRED = "54"
+BLOCKED = "62"
+VERIFICATION_FAILED = "N7"
+INSUFFICIENT_FUNDS = "51"
+SUSPECTED_FRAUD = "59"
+INVALID_AMOUNT = "13"
+
+UNKNOWN_TTL = 60  # secondi
+UNKNOWN_MAX = 100000  # numeri sconosciuti in cache, oltre si svuota
+
+
+class CardState:
+    __slots__ = ("card_id", "user_id", "last4", "expiry", "cvv_digest", "blocked", "expires_at")
+
+    def __init__(self, card_id, user_id, last4, expiry, cvv_digest, blocked):
+        self.card_id = card_id
+        self.user_id = user_id
+        self.last4 = last4
+        self.expiry = expiry
+        self.cvv_digest = cvv_digest
+        self.blocked = bool(blocked)
+        self.expires_at = _expiry_end(expiry)
+
+
+def _expiry_end(expiry):
+    """'MM/YY' -> primo istante del mese successivo (la carta vale per tutto il mese)."""
+    month, year = int(expiry[:2]), 2000 + int(expiry[3:])
+    return datetime(year + month // 12, month % 12 + 1, 1)
+
+
+class CardIndex:
+    def __init__(self, secret, max_staleness=0.1):
+        self._secret = (secret or "card-index").encode()
+        self.max_staleness = max_staleness
+        self._checked_at = 0.0
+        self._by_key = {}
+        self._first_by_user = {}  # user_id -> CardState della prima carta (id più basso)
+        self._unknown = {}  # chiave -> scadenza (monotonic) dei numeri non trovati nel DB
+        self.version = 0
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def key(self, number):
+        return hmac.new(self._secret, number.encode(), hashlib.sha256).digest()
+
+    def _digest(self, number, cvv):
+        return hmac.new(self._secret, f"{number}:{cvv}".encode(), hashlib.sha256).digest()
+
+    def _state(self, row):
+        return CardState(row.id, row.user_id, row.number[-4:], row.expiry,
+                         self._digest(row.number, row.cvv), row.blocked)
+
+    def _put(self, row):
+        state = self._state(row)
+        key = self.key(row.number)
+        self._by_key[key] = state
+        self._unknown.pop(key, None)
+        first = self._first_by_user.get(row.user_id)
+        if first is None or first.card_id >= row.id:
+            self._first_by_user[row.user_id] = state
+        return state
+
+    def _select(self):
+        t = Card.__table__
+        return db.select(t.c.id, t.c.number, t.c.expiry, t.c.cvv, t.c.user_id, t.c.blocked)
+
+    def load(self):
+        """Carica tutte le carte con una sola query Core."""
+        t = Card.__table__
+        with db.engine.connect() as conn:
+            version = conn.execute(db.select(db.func.coalesce(db.func.max(t.c.state_version), 0))).scalar()
+            rows = conn.execute(self._select()).all()
+        with self._lock:
+            self._by_key = {}
+            self._first_by_user = {}
+            self._unknown = {}
+            for row in rows:
+                self._put(row)
+            self.version = version
+            self.loaded = True
+        return len(rows)
+
+    def refresh_changed(self):
+        """Ricarica le carte bloccate/sbloccate (anche da altri worker) dopo l'ultima versione vista."""
+        if not self.loaded:
+            self.load()
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.max_staleness:
+            return
+        self._checked_at = now
+        t = Card.__table__
+        with db.engine.connect() as conn:
+            version = conn.execute(db.select(db.func.max(t.c.state_version))).scalar() or 0
+            if version <= self.version:
+                return
+            rows = conn.execute(self._select().where(t.c.state_version > self.version)).all()
+        with self._lock:
+            for row in rows:
+                self._put(row)
+            self.version = max(self.version, version)
+
+    def lookup(self, number):
+        key = self.key(number)
+        state = self._by_key.get(key)
+        if state is None:
+            now = time.monotonic()
+            if self._unknown.get(key, 0) > now:
+                return None
+            # carta non ancora vista da questo worker: un solo accesso al DB per numero ogni UNKNOWN_TTL
+            with db.engine.connect() as conn:
+                row = conn.execute(self._select().where(Card.__table__.c.number == number)).first()
+            with self._lock:
+                if row is not None:
+                    state = self._put(row)
+                else:
+                    if len(self._unknown) >= UNKNOWN_MAX:
+                        self._unknown = {}
+                    self._unknown[key] = now + UNKNOWN_TTL
+        return state
+
+    def invalidate(self, card):
+        """Aggiorna subito lo stato locale dopo block/unblock in questo worker."""
+        with self._lock:
+            self._put(card)
+
+    def first_card_blocked(self, user_id):
+        self.refresh_changed()
+        state = self._first_by_user.get(user_id)
+        if state is None:
+            card = Card.query.filter_by(user_id=user_id).order_by(Card.id).first()
+            if card is None:
+                return False
+            state = self.lookup(card.number)
+        return state.blocked
+
+    def check(self, number, expiry, cvv, now=None):
+        """Verifica la carta senza toccare il saldo; ritorna (codice, CardState|None)."""
+        self.refresh_changed()
+        state = self.lookup(number)
+        if state is None:
+            return INVALID_CARD, None
+        if state.blocked:
+            return BLOCKED, state
+        # scadenza e CVV verificati entrambi, con un'unica risposta: "54" solo a dati corretti
+        cvv_ok = hmac.compare_digest(self._digest(number, cvv), state.cvv_digest)
+        if not (hmac.compare_digest(expiry.encode(), state.expiry.encode()) and cvv_ok):
+            return VERIFICATION_FAILED, state
+        if (now or datetime.now()) >= state.expires_at:
+            return EXPIRED, state
+        return APPROVED, state
+
+
+def next_state_version():
+    """Valore di Card.state_version per una carta nuova o appena cambiata (subquery, calcolata nel commit)."""
+    return db.select(db.func.coalesce(db.func.max(Card.state_version), 0) + 1).scalar_subquery()
+
+
+def set_card_blocked(index, card, blocked):
+    """Blocca/sblocca una carta e ne avanza la state_version, così gli altri worker se ne accorgono."""
+    card.blocked = blocked
+    card.state_version = next_state_version()
+    if not blocked:
+        card.cvv_failures = 0
+    db.session.commit()
+    index.invalidate(card)
+
+
+def register_verification_failure(index, state, max_failures):
+    """
+    Conta una scadenza o un CVV errati sulla carta; al max_failures-esimo consecutivo la blocca
+    (anche per gli altri worker). Ritorna True se la carta è stata bloccata ora.
+    """
+    cards = Card.__table__
+    with db.engine.begin() as conn:
+        failures = conn.execute(
+            cards.update().where(cards.c.id == state.card_id)
+            .values(cvv_failures=cards.c.cvv_failures + 1)
+            .returning(cards.c.cvv_failures)
+        ).scalar()
+        if failures is None or failures < max_failures:
+            return False
+        blocked = conn.execute(
+            cards.update().where(cards.c.id == state.card_id, cards.c.blocked.isnot(True))
+            .values(blocked=True, state_version=next_state_version())
+        ).rowcount
+    state.blocked = True
+    return bool(blocked)
+
+
+def capture(state, amount, merchant, risk_score=None):
+    """
+    Addebito atomico: UPDATE condizionato sul saldo + inserimento del movimento,
+    nella stessa transazione. Ritorna (codice, transaction_id|None).
+    """
+    cards = Card.__table__
+    txs = Transaction.__table__
+    with db.engine.begin() as conn:
+        balance_after = change_balance(state.user_id, -amount, conn)
+        if balance_after is None:
+            return INSUFFICIENT_FUNDS, None
+        tx_id = conn.execute(txs.insert().values(
+            amount=-amount,
+            timestamp=datetime.now(),
+            type="card",
+            category="pagamento carta",
+            user_id=state.user_id,
+            balance_after=balance_after,
+            details=f"{merchant or 'esercente'} (carta ****{state.last4})",
+            risk_score=risk_score,
+        )).inserted_primary_key[0]
+        # scadenza e CVV corretti: riparte il conteggio degli errori consecutivi
+        conn.execute(cards.update().where(cards.c.id == state.card_id, cards.c.cvv_failures > 0)
+                     .values(cvv_failures=0))
+    return APPROVED, tx_id
+
+
+def init_app(app):
+    index = CardIndex(app.config.get("SECRET_KEY"), app.config.get("CARD_STATE_MAX_STALENESS", 0.1))
+    app.extensions["card_index"] = index
+    return index
+
+
+def get_index(app):
+    return app.extensions["card_index"]
@@ -18,7 +18,51 @@ class Config:
     ALPHA_VANTAGE_API_KEY = os.environ.get("ALPHA_VANTAGE_API_KEY") or "YOUR_API_KEY_HERE"
 
     
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///bank.db'
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", 'sqlite:///bank.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SESSION_PERMANENT = True
-    PERMANENT_SESSION_LIFETIME = timedelta(minutes=15)
\ No newline at end of file
+    PERMANENT_SESSION_LIFETIME = timedelta(minutes=15)
+
+    # Sessioni lato server: "memory", "sqlite" oppure "shared" (store condiviso stile Redis)
+    SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+    SESSION_SHARED_URL = os.environ.get("SESSION_SHARED_URL", "local://")
+    SESSION_SWEEP_INTERVAL = 60  # secondi tra due pulizie delle sessioni scadute
+    OTP_TTL_SECONDS = 300
+    OTP_MAX_ATTEMPTS = 3
+
+    # Avvio a freddo: bytecode dei template in una cache su disco condivisa dai worker
+    TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR")  # default: instance/jinja_cache
+
+    # Audit log: eventi in buffer, scritti a batch da un thread ("db" e/o "ndjson")
+    AUDIT_SINKS = os.environ.get("AUDIT_SINKS", "db")
+    AUDIT_BATCH_SIZE = 200
+    AUDIT_FLUSH_INTERVAL = 2.0  # secondi
+    AUDIT_SEGMENT_DIR = os.environ.get("AUDIT_SEGMENT_DIR")  # default: instance/audit
+    AUDIT_SEGMENT_BYTES = 16 * 1024 * 1024
+
+    # Motore antifrode (risk.py): soglie di punteggio 0..1 e segnali
+    RISK_FLAG_SCORE = 0.4  # sopra: movimento eseguito ma segnalato
+    RISK_HOLD_SCORE = 0.8  # sopra: movimento sospeso
+    RISK_VELOCITY_WINDOW = 600  # secondi
+    RISK_VELOCITY_LIMIT = 5  # movimenti nella finestra
+    RISK_ZSCORE_LIMIT = 3.0
+    RISK_SYNC_INTERVAL = 1.0  # secondi prima di vedere i movimenti fatti da un altro worker
+
+    # Autorizzazioni carta (/api/cards/authorize): senza chiave dei terminali l'endpoint è disattivato
+    CARD_TERMINAL_KEY = os.environ.get("CARD_TERMINAL_KEY")
+    CARD_MAX_CVV_FAILURES = 3  # scadenze o CVV errati consecutivi prima del blocco della carta
+    CARD_STATE_MAX_STALENESS = 0.1  # secondi prima di vedere un blocco fatto da un altro worker
+
+    # Mercato crypto (market.py/trading.py): prezzi in polling e ordini eseguiti sull'ultimo tick
+    MARKET_POLL_ENABLED = os.environ.get("MARKET_POLL_ENABLED", "1") == "1"
+    MARKET_SYMBOLS = os.environ.get("MARKET_SYMBOLS", "bitcoin,ethereum,solana")
+    MARKET_POLL_INTERVAL = int(os.environ.get("MARKET_POLL_INTERVAL", 15))  # secondi
+    MARKET_PRICE_MAX_AGE = 60  # secondi: oltre, un ordine market richiede un prezzo nuovo
+    ALERT_QUEUE_SIZE = 10000  # notifiche di avvisi prezzo in attesa di invio
+
+    # Snapshot del database per benchmark e dati sintetici (fixtures.py)
+    SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR")  # default: instance/snapshots
+
+    # Tassi di cambio: aggiornati in background (la BCE pubblica una volta al giorno)
+    FX_REFRESH_ENABLED = os.environ.get("FX_REFRESH_ENABLED", "1") == "1"
+    FX_REFRESH_INTERVAL = int(os.environ.get("FX_REFRESH_INTERVAL", 6 * 3600))  # secondi
@@ -0,0 +1,352 @@
+"""
+fixtures.py — dati sintetici su larga scala e snapshot del database.
+
+Il generatore è deterministico: a parità di --seed, --end e parametri produce
+sempre le stesse righe. Usa due flussi casuali separati (prezzi e utenti), così
+cambiare il numero di utenti non cambia le serie di prezzo.
+
+Per ogni utente genera una sequenza ordinata nel tempo di movimenti (stipendi,
+prelievi, pagamenti carta, trasferimenti, compravendite crypto) con
+balance_after progressivo: il saldo non va mai sotto zero e User.balance è
+l'ultimo balance_after. Le compravendite usano il prezzo della serie sintetica
+all'istante del trade e hanno il movimento di cassa corrispondente.
+
+Gli insert passano dal driver sqlite3 (executemany di tuple, id espliciti),
+a blocchi di --batch-size utenti per transazione. I trigger FTS sono sospesi
+durante il caricamento (search.bulk_load) e l'indice di ricerca viene
+aggiornato in un colpo solo alla fine.
+
+Gli snapshot usano la backup API di SQLite: copia consistente anche in WAL.
+Dopo un restore i worker vanno riavviati (indici in memoria di carte, antifrode,
+ordini e avvisi).
+
+Comandi CLI:
+    flask --app app seed-data --users 100000 --tx-per-user 30 --seed 42
+    flask --app app db-snapshot save base
+    flask --app app db-snapshot restore base
+"""
+import itertools
+import math
+import os
+import random
+import sqlite3
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+from backfill import INSERT_SQL as INSERT_PRICE_SQL, db_timestamp
+from models import Card, CryptoTrade, Transaction, User, db
+from search import bulk_load
+from utility import make_iban
+
+DEFAULT_END = datetime(2026, 1, 1)
+SYNTHETIC_PASSWORD = "password"
+SYNTHETIC_PIN = "123456"
+
+SYMBOLS = {"bitcoin": 40000.0, "ethereum": 2500.0, "solana": 100.0}  # prezzo iniziale USD
+CURRENCIES = (("EUR", 0.8), ("USD", 0.1), ("GBP", 0.05), ("CHF", 0.03), ("JPY", 0.02))
+USD_RATES = {"EUR": 0.92, "USD": 1.0, "GBP": 0.79, "CHF": 0.88, "JPY": 150.0}  # cambi fissi indicativi
+
+FIRST_NAMES = ("Marco", "Giulia", "Luca", "Sara", "Matteo", "Chiara", "Andrea", "Francesca",
+               "Alessandro", "Martina", "Davide", "Elena", "Simone", "Laura", "Federico", "Anna")
+LAST_NAMES = ("Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci",
+              "Marino", "Greco", "Bruno", "Gallo", "Conti", "De Luca", "Costa", "Giordano")
+MERCHANTS = ("Esselunga", "Coop", "Amazon", "Trenitalia", "Eni", "Zara", "Feltrinelli",
+             "Ikea", "Farmacia", "Ristorante", "Bar", "Netflix", "Spotify", "MediaWorld")
+
+# (tipo di evento, peso) dopo il primo stipendio
+EVENTS = (("card", 45), ("withdraw", 12), ("deposit", 8), ("salary", 5),
+          ("transfer_out", 10), ("transfer_in", 8), ("crypto", 12))
+EVENT_KINDS = tuple(kind for kind, _ in EVENTS)
+EVENT_CUM_WEIGHTS = tuple(itertools.accumulate(weight for _, weight in EVENTS))
+
+
+def _insert_sql(model, columns):
+    names = ", ".join(f'"{c}"' for c in columns)
+    marks = ", ".join("?" for _ in columns)
+    return f'INSERT INTO "{model.__tablename__}" ({names}) VALUES ({marks})'
+
+
+USER_COLUMNS = ("id", "name", "email", "password", "balance", "currency", "iban", "pin", "failed_attempts")
+CARD_COLUMNS = ("id", "number", "expiry", "cvv", "user_id", "blocked", "state_version")
+TX_COLUMNS = ("id", "amount", "timestamp", "type", "user_id", "balance_after", "category", "details",
+              "counterparty_iban")
+TRADE_COLUMNS = ("id", "user_id", "symbol", "side", "amount", "price", "timestamp")
+
+INSERT_USER = _insert_sql(User, USER_COLUMNS)
+INSERT_CARD = _insert_sql(Card, CARD_COLUMNS)
+INSERT_TX = _insert_sql(Transaction, TX_COLUMNS)
+INSERT_TRADE = _insert_sql(CryptoTrade, TRADE_COLUMNS)
+
+
+class PriceSeries:
+    """Random walk geometrico a passo fisso per ogni simbolo; price_at fa una ricerca binaria."""
+
+    def __init__(self, seed, start, end, interval):
+        rng = random.Random(f"{seed}:prices")
+        self.start = start
+        self.interval = interval
+        steps = int((end - start).total_seconds() // interval) + 1
+        self.prices = {}
+        for symbol, price in SYMBOLS.items():
+            series = []
+            for _ in range(steps):
+                series.append(round(price, 2))
+                price *= math.exp(rng.gauss(0.0, 0.004))
+            self.prices[symbol] = series
+        self.stamps = [start + timedelta(seconds=i * interval) for i in range(steps)]
+
+    def price_at(self, symbol, ts):
+        return self.prices[symbol][max(0, bisect_right(self.stamps, ts) - 1)]
+
+    def rows(self):
+        stamps = [db_timestamp(ts) for ts in self.stamps]
+        for symbol, series in self.prices.items():
+            yield from zip([symbol] * len(series), stamps, series)
+
+
+class Generator:
+    def __init__(self, seed=42, users=1000, tx_per_user=30, days=365, end=DEFAULT_END,
+                 price_interval=300, batch_size=2000):
+        self.seed = seed
+        self.n_users = users
+        self.tx_per_user = tx_per_user
+        self.end = end
+        self.start = end - timedelta(days=days)
+        self.batch_size = batch_size
+        self.rng = random.Random(f"{seed}:users")
+        self.series = PriceSeries(seed, self.start, end, price_interval)
+        # un solo hash per tutti: generarne uno per utente costerebbe ~50 ms a testa
+        self.password_hash = generate_password_hash(SYNTHETIC_PASSWORD)
+        self.pin_hash = generate_password_hash(SYNTHETIC_PIN)
+        self.counts = {"users": 0, "cards": 0, "transactions": 0, "trades": 0, "prices": 0}
+
+    def _next_ids(self, conn):
+        ids = {}
+        for model in (User, Card, Transaction, CryptoTrade):
+            ids[model] = conn.exec_driver_sql(f'SELECT COALESCE(MAX(id), 0) FROM "{model.__tablename__}"').scalar() + 1
+        return ids
+
+    def _currency(self):
+        r = self.rng.random()
+        for code, weight in CURRENCIES:
+            if r < weight:
+                return code
+            r -= weight
+        return "EUR"
+
+    def _iban(self, user_id):
+        # CIN "S" non compare negli IBAN generati da generate_iban (solo cifre): nessuna collisione
+        return make_iban(f"S{self.seed % 100000:05d}{user_id:017d}")
+
+    def _user(self, user_id, ids, out):
+        rng = self.rng
+        currency = self._currency()
+        iban = self._iban(user_id)
+        fx = USD_RATES[currency]
+        salary = round(rng.uniform(1200, 4000) * fx, 2)
+
+        n = max(1, int(rng.expovariate(1.0 / self.tx_per_user)) if self.tx_per_user else 0)
+        span = (self.end - self.start).total_seconds()
+        stamps = sorted(self.start + timedelta(seconds=rng.random() * span) for _ in range(n))
+
+        balance = 0.0
+        positions = {}
+        first = True
+        for ts in stamps:
+            kind = "salary" if first else rng.choices(EVENT_KINDS, cum_weights=EVENT_CUM_WEIGHTS)[0]
+            first = False
+            details, counterparty, category = None, None, None
+
+            if kind == "salary":
+                kind, amount, category, details = "deposit", salary, "stipendio", "Stipendio"
+            elif kind == "deposit":
+                amount = round(rng.lognormvariate(4.5, 0.8) * fx, 2)
+            elif kind == "withdraw":
+                amount = -round(rng.choice((20, 50, 100, 200, 250)) * fx, 2)
+            elif kind == "card":
+                merchant = rng.choice(MERCHANTS)
+                amount = -round(rng.lognormvariate(3.0, 0.9) * fx, 2)
+                category, details = "pagamento carta", f"{merchant} (carta ****{self._card_number(ids[Card])[-4:]})"
+            elif kind in ("transfer_out", "transfer_in"):
+                counterparty = self._iban(rng.randrange(1, user_id + self.n_users))
+                value = round(rng.lognormvariate(4.8, 1.0) * fx, 2)
+                if kind == "transfer_out":
+                    amount, category, details = -value, "trasferimento IBAN in uscita", f"a IBAN {counterparty}"
+                else:
+                    amount, category, details = value, "trasferimento IBAN in entrata", f"da IBAN {counterparty}"
+                kind = "transfer"
+            else:
+                symbol = rng.choice(tuple(SYMBOLS))
+                price = self.series.price_at(symbol, ts)
+                held = positions.get(symbol, 0.0)
+                side = "sell" if held > 0 and rng.random() < 0.4 else "buy"
+                if side == "buy":
+                    quantity = round(rng.lognormvariate(4.5, 0.8) / price, 6) or 1e-6
+                else:
+                    quantity = round(held * rng.choice((0.25, 0.5, 1.0)), 6) or held
+                value = round(quantity * price * fx, 2)
+                amount = -value if side == "buy" else value
+                if amount < 0 and balance + amount < 0:
+                    continue
+                positions[symbol] = held + (quantity if side == "buy" else -quantity)
+                out["trades"].append((ids[CryptoTrade], user_id, symbol, side, quantity, price, db_timestamp(ts)))
+                ids[CryptoTrade] += 1
+                kind = "crypto"
+                category = "acquisto crypto" if side == "buy" else "vendita crypto"
+                details = f"{side} {quantity:g} {symbol} @ {price:,.2f} USD"
+
+            if amount < 0 and balance + amount < 0:
+                # fondi insufficienti: al suo posto un versamento
+                kind, amount, category, details, counterparty = "deposit", -amount, None, None, None
+            balance = round(balance + amount, 2)
+            out["transactions"].append((ids[Transaction], amount, db_timestamp(ts), kind, user_id, balance,
+                                        category, details, counterparty))
+            ids[Transaction] += 1
+
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        out["users"].append((user_id, f"{first_name} {last_name}", f"user{user_id}@example.test",
+                             self.password_hash, balance, currency, iban, self.pin_hash, 0))
+
+        for _ in range(2 if rng.random() < 0.1 else 1):
+            card_id = ids[Card]
+            expiry = f"{rng.randint(1, 12):02d}/{rng.randint(27, 31)}"
+            out["cards"].append((card_id, self._card_number(card_id), expiry, f"{rng.randrange(1000):03d}",
+                                 user_id, rng.random() < 0.02, 0))
+            ids[Card] += 1
+
+    @staticmethod
+    def _card_number(card_id):
+        return f"4999{card_id:012d}"
+
+    def run(self, progress=None):
+        with db.engine.begin() as conn:
+            ids = self._next_ids(conn)
+            prices = list(self.series.rows())
+            self.counts["prices"] = conn.exec_driver_sql(INSERT_PRICE_SQL, prices).rowcount
+
+        with bulk_load():
+            first_user = ids[User]
+            for batch_start in range(0, self.n_users, self.batch_size):
+                out = {"users": [], "cards": [], "transactions": [], "trades": []}
+                for offset in range(batch_start, min(batch_start + self.batch_size, self.n_users)):
+                    self._user(first_user + offset, ids, out)
+                with db.engine.begin() as conn:
+                    conn.exec_driver_sql(INSERT_USER, out["users"])
+                    conn.exec_driver_sql(INSERT_CARD, out["cards"])
+                    if out["transactions"]:
+                        conn.exec_driver_sql(INSERT_TX, out["transactions"])
+                    if out["trades"]:
+                        conn.exec_driver_sql(INSERT_TRADE, out["trades"])
+                for key in ("users", "cards", "transactions", "trades"):
+                    self.counts[key] += len(out[key])
+                if progress:
+                    progress(self.counts)
+        return self.counts
+
+
+# -----------------------------
+# Snapshot
+# -----------------------------
+
+def snapshot_dir():
+    return current_app.config.get("SNAPSHOT_DIR") or os.path.join(current_app.instance_path, "snapshots")
+
+
+def snapshot_path(name):
+    if not name or os.sep in name or name.startswith("."):
+        raise click.ClickException(f"Nome di snapshot non valido: {name!r}")
+    return os.path.join(snapshot_dir(), f"{name}.db")
+
+
+def save_snapshot(path):
+    """Copia consistente del database corrente in path (backup API di SQLite)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    raw = db.engine.raw_connection()
+    try:
+        target = sqlite3.connect(path)
+        try:
+            raw.driver_connection.backup(target)
+        finally:
+            target.close()
+    finally:
+        raw.close()
+
+
+def restore_snapshot(path):
+    """Sostituisce il contenuto del database con lo snapshot (pagina per pagina, in una transazione)."""
+    if not os.path.exists(path):
+        raise click.ClickException(f"Snapshot inesistente: {path}")
+    db.engine.dispose()
+    source = sqlite3.connect(path)
+    raw = db.engine.raw_connection()
+    try:
+        source.backup(raw.driver_connection)
+    finally:
+        raw.close()
+        source.close()
+    db.engine.dispose()
+
+
+@click.command("seed-data")
+@click.option("--users", default=1000, show_default=True)
+@click.option("--tx-per-user", default=30, show_default=True, help="media, distribuzione esponenziale")
+@click.option("--days", default=365, show_default=True)
+@click.option("--end", type=click.DateTime(), default=DEFAULT_END.strftime("%Y-%m-%d"), show_default=True)
+@click.option("--price-interval", default=300, show_default=True, help="secondi tra due prezzi sintetici")
+@click.option("--seed", default=42, show_default=True)
+@click.option("--batch-size", default=2000, show_default=True, help="utenti per transazione")
+def seed_data_command(users, tx_per_user, days, end, price_interval, seed, batch_size):
+    """Genera utenti, carte, movimenti, trade e prezzi sintetici (deterministici per seed)."""
+    started = time.perf_counter()
+    generator = Generator(seed, users, tx_per_user, days, end, price_interval, batch_size)
+    counts = generator.run(progress=lambda c: click.echo(
+        f"\r{c['users']:,} utenti, {c['transactions']:,} movimenti", nl=False))
+    elapsed = time.perf_counter() - started
+    rows = sum(counts.values())
+    click.echo(f"\r{counts['users']:,} utenti, {counts['cards']:,} carte, {counts['transactions']:,} movimenti, "
+               f"{counts['trades']:,} trade, {counts['prices']:,} prezzi in {elapsed:.1f}s "
+               f"({rows / max(elapsed, 1e-9):,.0f} righe/s)")
+    click.echo(f"Password di tutti gli utenti: {SYNTHETIC_PASSWORD!r}, PIN: {SYNTHETIC_PIN!r}")
+
+
+@click.group("db-snapshot")
+def db_snapshot_group():
+    """Salva e ripristina snapshot del database (instance/snapshots)."""
+
+
+@db_snapshot_group.command("save")
+@click.argument("name")
+def snapshot_save_command(name):
+    path = snapshot_path(name)
+    started = time.perf_counter()
+    save_snapshot(path)
+    click.echo(f"Snapshot {path} ({os.path.getsize(path) / 1e6:,.1f} MB) in {time.perf_counter() - started:.1f}s")
+
+
+@db_snapshot_group.command("restore")
+@click.argument("name")
+def snapshot_restore_command(name):
+    path = snapshot_path(name)
+    started = time.perf_counter()
+    restore_snapshot(path)
+    click.echo(f"Database ripristinato da {path} in {time.perf_counter() - started:.1f}s; riavvia i worker.")
+
+
+@db_snapshot_group.command("list")
+def snapshot_list_command():
+    directory = snapshot_dir()
+    names = sorted(f for f in os.listdir(directory) if f.endswith(".db")) if os.path.isdir(directory) else []
+    for name in names:
+        path = os.path.join(directory, name)
+        stamp = datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M")
+        click.echo(f"{name[:-3]:<30} {os.path.getsize(path) / 1e6:>10,.1f} MB  {stamp}")
+
+
+def init_app(app):
+    app.cli.add_command(seed_data_command)
+    app.cli.add_command(db_snapshot_group)
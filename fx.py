@@ -0,0 +1,125 @@
+"""
+fx.py — tassi di cambio in memoria per i conti multi-valuta.
+
+I tassi (base EUR, fonte BCE via Frankfurter) vengono scaricati da un thread
+in background e salvati nella tabella FxRate; le conversioni sul percorso
+delle richieste leggono solo il dizionario in memoria, senza chiamate di rete.
+
+Esempio:
+    from fx import rate_table
+    rate_table.convert(100, "USD", "EUR")   # -> (importo_convertito, tasso)
+"""
+import threading
+from datetime import datetime
+
+from models import FxRate, db
+from prices import PriceError, get_fx_rates
+
+BASE_CURRENCY = "EUR"
+SUPPORTED_CURRENCIES = ("EUR", "USD", "GBP", "CHF", "JPY")
+
+
+class FxRateTable:
+    """Cache thread-safe dei tassi base→valuta, sostituita in blocco ad ogni refresh."""
+
+    def __init__(self, base=BASE_CURRENCY):
+        self.base = base
+        self._rates = {base: 1.0}
+        self.asof = None
+        self._lock = threading.Lock()
+
+    def load(self, rates, asof=None):
+        rates = dict(rates)
+        rates[self.base] = 1.0
+        # il dizionario viene sostituito, mai modificato: i lettori non hanno bisogno del lock
+        with self._lock:
+            self._rates = rates
+            self.asof = asof
+
+    def is_loaded(self):
+        return len(self._rates) > 1
+
+    def rate(self, base, quote):
+        """Tasso base→quote calcolato come cross rate sulla valuta base della tabella."""
+        base = base.upper()
+        quote = quote.upper()
+        if base == quote:
+            return 1.0
+        rates = self._rates
+        try:
+            return rates[quote] / rates[base]
+        except KeyError:
+            raise PriceError(f"Tasso {base}->{quote} non disponibile.") from None
+
+    def convert(self, amount, base, quote):
+        """Ritorna (importo convertito arrotondato al centesimo, tasso usato)."""
+        rate = self.rate(base, quote)
+        return round(amount * rate, 2), rate
+
+    def load_from_db(self):
+        """Popola la cache dalla tabella FxRate; ritorna la data dell'ultimo aggiornamento (o None)."""
+        rows = FxRate.query.all()
+        if not rows:
+            return None
+        self.load({r.currency: r.rate for r in rows}, asof=max(r.asof or "" for r in rows) or None)
+        return max(r.updated_at for r in rows)
+
+    def refresh(self):
+        """Scarica la tabella completa (una chiamata HTTP) e la salva su DB e in memoria."""
+        rates, asof = get_fx_rates(self.base)
+        now = datetime.now()
+        for currency, rate in rates.items():
+            db.session.merge(FxRate(currency=currency, rate=rate, asof=asof, updated_at=now))
+        db.session.commit()
+        self.load(rates, asof)
+
+
+rate_table = FxRateTable()
+
+
+class FxRefresher(threading.Thread):
+    """Thread daemon che aggiorna periodicamente i tassi (la BCE li pubblica una volta al giorno)."""
+
+    def __init__(self, app, table=rate_table, interval=None):
+        super().__init__(name="fx-refresher", daemon=True)
+        self.app = app
+        self.table = table
+        self.interval = interval or app.config.get("FX_REFRESH_INTERVAL", 6 * 3600)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        with self.app.app_context():
+            try:
+                updated_at = self.table.load_from_db()
+            except Exception:
+                # tabella non ancora creata: verrà popolata dal primo refresh
+                db.session.rollback()
+                updated_at = None
+            # se un altro worker ha aggiornato i tassi di recente non serve riscaricarli subito
+            if updated_at and (datetime.now() - updated_at).total_seconds() < self.interval:
+                self._stop_event.wait(self.interval - (datetime.now() - updated_at).total_seconds())
+            while not self._stop_event.is_set():
+                try:
+                    self.table.refresh()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.warning("Aggiornamento tassi FX fallito: %s", e)
+                finally:
+                    db.session.remove()
+                self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def init_app(app):
+    """
+    Registra il refresher dei tassi tra i worker in background dell'app
+    (disattivabile con FX_REFRESH_ENABLED=False); lo avvia app.start_background_workers.
+    """
+    if not app.config.get("FX_REFRESH_ENABLED", True):
+        return None
+    refresher = FxRefresher(app)
+    app.extensions.setdefault("background_workers", []).append(refresher)
+    app.extensions["fx_refresher"] = refresher
+    return refresher
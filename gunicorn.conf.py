@@ -0,0 +1,69 @@
+"""
+Profilo gunicorn per la produzione:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Variabili d'ambiente: PORT, WEB_CONCURRENCY (processi), WEB_THREADS (thread per
+processo), PRELOAD_APP, MAX_REQUESTS. Con più processi usare SESSION_BACKEND
+"sqlite" o "shared": le sessioni "memory" non sono condivise tra worker.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# processi per usare tutti i core, thread per sovrapporre l'I/O (SQLite, SMTP, API prezzi)
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+
+# preload: l'app (e i template precompilati) vengono caricati una volta nel master
+# e condivisi copy-on-write dai worker
+preload_app = os.environ.get("PRELOAD_APP", "1") == "1"
+
+timeout = 30
+graceful_timeout = 20
+keepalive = 5
+
+# riciclo periodico dei worker (il jitter evita che ripartano tutti insieme)
+max_requests = int(os.environ.get("MAX_REQUESTS", 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+
+def on_starting(server):
+    # schema creato una sola volta, prima del fork dei worker, in un processo a parte:
+    # importare wsgi qui lascerebbe l'app in sys.modules del master e senza preload i
+    # worker (anche dopo un HUP) riuserebbero il codice caricato all'avvio
+    subprocess.run(
+        [sys.executable, "-c", "from app import create_app, init_db; init_db(create_app())"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+    )
+
+
+def when_ready(server):
+    # con preload l'app è già nel master: template e mapper preparati una volta,
+    # condivisi copy-on-write dai worker
+    if server.cfg.preload_app:
+        from warmup import warm_up
+        from wsgi import app
+        warm_up(app)
+
+
+def post_fork(server, worker):
+    from app import start_background_workers
+    from models import db
+    from wsgi import app
+    # le connessioni aperte dal master non vanno condivise tra processi
+    with app.app_context():
+        db.engine.dispose(close=False)
+    start_background_workers(app)
+
+
+def worker_exit(server, worker):
+    from app import stop_background_workers
+    from wsgi import app
+    stop_background_workers(app)
@@ -0,0 +1,45 @@
+"""
+health.py — endpoint di liveness e readiness per load balancer / orchestratori.
+
+    GET /healthz  processo vivo (nessun accesso a DB o sessione)
+    GET /readyz   pronto a ricevere traffico: DB raggiungibile e processo non in chiusura
+"""
+from flask import Blueprint, current_app, jsonify
+
+from fx import rate_table
+from models import db
+
+bp = Blueprint('health', __name__)
+
+
+def init_app(app):
+    """Registra il Blueprint degli health check."""
+    app.register_blueprint(bp)
+
+
+@bp.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+@bp.route("/readyz")
+def readyz():
+    checks = {}
+    ready = True
+
+    try:
+        with db.engine.connect() as conn:
+            conn.execute(db.text("SELECT 1"))
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = f"errore: {e.__class__.__name__}"
+        ready = False
+
+    # informativo: senza tassi solo i trasferimenti cross-valuta vengono rifiutati
+    checks["fx_rates"] = rate_table.asof or "non caricati"
+
+    if current_app.extensions.get("shutting_down"):
+        checks["lifecycle"] = "in chiusura"
+        ready = False
+
+    return jsonify({"status": "ready" if ready else "not ready", "checks": checks}), 200 if ready else 503
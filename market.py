@@ -0,0 +1,142 @@
+"""
+market.py — flusso dei prezzi crypto in memoria.
+
+Ogni nuovo prezzo (tick) passa da publish(): aggiorna l'ultimo prezzo noto per
+simbolo e lo notifica ai listener registrati (es. il motore degli ordini in
+trading.py), così nessuno deve interrogare CoinGecko sul percorso della richiesta.
+
+I tick arrivano da due fonti:
+    - /api/crypto/<symbol>, quando qualcuno ha il grafico aperto
+    - PricePoller, un thread che ogni MARKET_POLL_INTERVAL secondi scarica i
+      prezzi di MARKET_SYMBOLS con una sola chiamata e li salva in CryptoPriceHistory
+
+Con più worker solo quello che ottiene il lock su instance/price-poller.lock
+interroga CoinGecko; gli altri leggono l'ultimo prezzo da CryptoPriceHistory.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo processo (waitress), nessun lock necessario
+    fcntl = None
+
+from models import CryptoPriceHistory, db
+from prices import get_crypto_prices
+
+
+class PriceFeed:
+    def __init__(self):
+        self._latest = {}  # symbol -> (price, datetime)
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """listener(symbol, price, timestamp), chiamato ad ogni tick (dentro un app context)."""
+        self._listeners.append(listener)
+
+    def latest(self, symbol, max_age=None):
+        """Ultimo prezzo noto, oppure None se assente o più vecchio di max_age secondi."""
+        entry = self._latest.get(symbol)
+        if entry is None:
+            return None
+        price, ts = entry
+        if max_age is not None and (datetime.now() - ts).total_seconds() > max_age:
+            return None
+        return price
+
+    def publish(self, symbol, price, timestamp=None, logger=None):
+        timestamp = timestamp or datetime.now()
+        self._latest[symbol] = (price, timestamp)
+        for listener in self._listeners:
+            try:
+                listener(symbol, price, timestamp)
+            except Exception as e:
+                if logger:
+                    logger.exception("Listener prezzi fallito su %s: %s", symbol, e)
+                else:
+                    raise
+
+
+class PricePoller(threading.Thread):
+    def __init__(self, app, feed, symbols, interval):
+        super().__init__(name="price-poller", daemon=True)
+        self.app = app
+        self.feed = feed
+        self.symbols = symbols
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._lock_file = None
+
+    def is_leader(self):
+        """Un solo processo per macchina fa polling: lock esclusivo tenuto fino all'uscita."""
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            os.makedirs(self.app.instance_path, exist_ok=True)
+            self._lock_file = open(os.path.join(self.app.instance_path, "price-poller.lock"), "w")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def poll_once(self):
+        prices = get_crypto_prices(self.symbols)
+        now = datetime.now()
+        db.session.execute(db.insert(CryptoPriceHistory), [
+            {"symbol": symbol, "price": price, "timestamp": now} for symbol, price in prices.items()
+        ])
+        db.session.commit()
+        for symbol, price in prices.items():
+            self.feed.publish(symbol, price, now, logger=self.app.logger)
+        return len(prices)
+
+    def run(self):
+        with self.app.app_context():
+            while not self._stop_event.is_set():
+                started = time.monotonic()
+                try:
+                    if self.is_leader():
+                        self.poll_once()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.warning("Aggiornamento prezzi crypto fallito: %s", e)
+                finally:
+                    db.session.remove()
+                self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def latest_price(feed, symbol, max_age):
+    """
+    Prezzo recente senza bloccare su CoinGecko se possibile: cache in memoria,
+    poi ultimo campione in CryptoPriceHistory (scritto dal poller di un altro worker).
+    Ritorna None se non c'è un prezzo più giovane di max_age secondi.
+    """
+    price = feed.latest(symbol, max_age)
+    if price is not None:
+        return price
+    row = CryptoPriceHistory.query.filter_by(symbol=symbol) \
+        .order_by(CryptoPriceHistory.timestamp.desc()).first()
+    if row is not None and (datetime.now() - row.timestamp).total_seconds() <= max_age:
+        feed._latest[symbol] = (row.price, row.timestamp)
+        return row.price
+    return None
+
+
+def init_app(app):
+    feed = PriceFeed()
+    app.extensions["price_feed"] = feed
+    if app.config.get("MARKET_POLL_ENABLED", True):
+        symbols = [s.strip() for s in app.config.get("MARKET_SYMBOLS", "bitcoin").split(",") if s.strip()]
+        poller = PricePoller(app, feed, symbols, app.config.get("MARKET_POLL_INTERVAL", 15))
+        app.extensions.setdefault("background_workers", []).append(poller)
+    return feed
+
+
+def get_feed(app):
+    return app.extensions["price_feed"]
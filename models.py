@@ -1,14 +1,62 @@
+import json
+import sqlite3
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL: i lettori non bloccano lo scrittore (più worker sullo stesso file);
+    synchronous=NORMAL: un fsync per checkpoint invece che per ogni commit.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+# colonne aggiunte dopo la prima versione dello schema: create_all crea solo le
+# tabelle mancanti, non aggiunge colonne a quelle esistenti
+ADDED_COLUMNS = (
+    ("user", "currency", "VARCHAR(3) NOT NULL DEFAULT 'EUR'"),
+    ("transaction", "counterparty_iban", "VARCHAR(34)"),
+    ("transaction", "risk_score", "FLOAT"),
+    ("card", "state_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("card", "cvv_failures", "INTEGER NOT NULL DEFAULT 0"),
+    ("crypto_trade", "order_id", "INTEGER REFERENCES crypto_order (id)"),
+)
+
+
+def upgrade_schema():
+    """
+    Allinea un database creato da una versione precedente: ALTER TABLE ... ADD COLUMN
+    per le colonne mancanti e CREATE INDEX per gli indici mancanti. Idempotente.
+    """
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table}")')}
+            if column not in existing:
+                conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}')
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                # gli indici unici possono fallire sui doppioni: li crea chi li ripulisce (backfill.init_db)
+                if not index.unique:
+                    index.create(conn, checkfirst=True)
+
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=False, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(128), nullable=False)
     balance = db.Column(db.Float, default=0)
+    currency = db.Column(db.String(3), nullable=False, default="EUR")  # valuta del conto (ISO 4217)
     iban = db.Column(db.String(34), unique=True, nullable=True) 
     pin = db.Column(db.String(6), nullable=True)  # 6-digit PIN for ATM operations
     failed_attempts= db.Column(db.Integer,default=0)
@@ -22,6 +70,13 @@ class User(db.Model):
         return f'<User {self.name}>'
     
 class Transaction(db.Model):
+    # indici composti per lo storico per utente e i filtri di ricerca (search.py)
+    __table_args__ = (
+        db.Index("ix_transaction_user_ts", "user_id", "timestamp"),
+        db.Index("ix_transaction_user_amount", "user_id", "amount"),
+        db.Index("ix_transaction_user_category", "user_id", "category"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False) # positive for deposit, negative for withdrawal
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now) # default to current time
@@ -31,6 +86,8 @@ class Transaction(db.Model):
     balance_after = db.Column(db.Float, nullable=False)  # balance after this transaction
     category = db.Column(db.String(50))  # es: "transfer_out" or "transfer_in"
     details = db.Column(db.String(120))  # es: "to mario@email.com"
+    counterparty_iban = db.Column(db.String(34), nullable=True)  # IBAN della controparte nei trasferimenti
+    risk_score = db.Column(db.Float, nullable=True)  # punteggio del motore antifrode (risk.py), 0..1
 
 
     def __repr__(self):
@@ -45,6 +102,8 @@ class Card(db.Model):
     cvv = db.Column(db.String(3), nullable=False)     
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     blocked = db.Column(db.Boolean, default=False)
+    state_version = db.Column(db.Integer, nullable=False, default=0, index=True)  # avanza ad ogni emissione/block/unblock (cards.py)
+    cvv_failures = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # CVV errati consecutivi nelle autorizzazioni
     user = db.relationship('User', backref=db.backref('cards', lazy=True))
 
     def __repr__(self):
@@ -52,6 +111,9 @@ class Card(db.Model):
 
 
 class CryptoTrade(db.Model):
+    # posizione per utente/moneta (somma buy - sell) calcolata in fase di regolamento
+    __table_args__ = (db.Index("ix_crypto_trade_user_symbol", "user_id", "symbol"),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     symbol = db.Column(db.String(10), nullable=False)  # es. BTC
@@ -59,6 +121,7 @@ class CryptoTrade(db.Model):
     amount = db.Column(db.Float, nullable=False)  # quanto investito
     price = db.Column(db.Float, nullable=False)   # prezzo al momento del trade
     timestamp = db.Column(db.DateTime, default=datetime.now)
+    order_id = db.Column(db.Integer, db.ForeignKey("crypto_order.id"), nullable=True)  # ordine che l'ha generato (trading.py)
 
 
     def to_dict(self):
@@ -71,14 +134,125 @@ class CryptoTrade(db.Model):
             "timestamp": self.timestamp.isoformat()
         }
     
+class CryptoOrder(db.Model):
+    """
+    Ordine crypto: "market" eseguito subito all'ultimo prezzo noto, "limit" resta
+    "open" nel book in memoria (trading.py) finché un tick non raggiunge limit_price.
+    Stati: open -> filled | cancelled | rejected (reason: fondi o quantità insufficienti).
+    """
+    __table_args__ = (
+        db.Index("ix_crypto_order_status_symbol", "status", "symbol"),
+        db.Index("ix_crypto_order_user_status", "user_id", "status"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    symbol = db.Column(db.String(10), nullable=False)      # es. 'bitcoin'
+    side = db.Column(db.String(4), nullable=False)         # 'buy' / 'sell'
+    order_type = db.Column(db.String(6), nullable=False)   # 'market' / 'limit'
+    quantity = db.Column(db.Float, nullable=False)
+    limit_price = db.Column(db.Float, nullable=True)       # USD, solo per i limit
+    status = db.Column(db.String(10), nullable=False, default="open")
+    reason = db.Column(db.String(50), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    filled_at = db.Column(db.DateTime, nullable=True)
+    fill_price = db.Column(db.Float, nullable=True)        # USD
+
+    def __repr__(self):
+        return f'<CryptoOrder {self.id} {self.side} {self.quantity} {self.symbol} {self.status}>'
+
+
+class PriceAlert(db.Model):
+    """
+    Avviso di prezzo: scatta una sola volta quando un tick è >= threshold ("above")
+    o <= threshold ("below"). Valutato in memoria da alerts.py.
+    """
+    __table_args__ = (
+        db.Index("ix_price_alert_status_symbol", "status", "symbol"),
+        db.Index("ix_price_alert_user", "user_id", "created_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    symbol = db.Column(db.String(10), nullable=False)      # es. 'bitcoin'
+    direction = db.Column(db.String(5), nullable=False)    # 'above' / 'below'
+    threshold = db.Column(db.Float, nullable=False)        # USD
+    status = db.Column(db.String(10), nullable=False, default="active")  # active / triggered
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    triggered_at = db.Column(db.DateTime, nullable=True)
+    triggered_price = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f'<PriceAlert {self.symbol} {self.direction} {self.threshold} {self.status}>'
+
+
 class CryptoPriceHistory(db.Model):
     """
     Memorizza la cronologia dei prezzi delle criptovalute per la visualizzazione sul grafico.
     """
+    # un solo campione per (symbol, timestamp): gli import massivi (backfill.py) scartano i doppioni
+    __table_args__ = (db.Index("ux_crypto_price_symbol_ts", "symbol", "timestamp", unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
-    symbol = db.Column(db.String(10), nullable=False, index=True)  # es. 'bitcoin'
+    symbol = db.Column(db.String(10), nullable=False)  # es. 'bitcoin' (indicizzato da ux_crypto_price_symbol_ts)
     price = db.Column(db.Float, nullable=False)                  # Prezzo in USD
     timestamp = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)
 
     def __repr__(self):
-        return f'<PriceHistory {self.symbol} @ {self.price} on {self.timestamp}>'
\ No newline at end of file
+        return f'<PriceHistory {self.symbol} @ {self.price} on {self.timestamp}>'
+
+
+class FxRate(db.Model):
+    """
+    Tabella dei tassi di cambio rispetto alla valuta base (EUR, fonte BCE via Frankfurter).
+    Viene aggiornata in background e letta all'avvio per popolare la cache in memoria.
+    """
+    currency = db.Column(db.String(3), primary_key=True)  # es. 'USD'
+    rate = db.Column(db.Float, nullable=False)            # 1 EUR = rate <currency>
+    asof = db.Column(db.String(10))                       # data di riferimento BCE (YYYY-MM-DD)
+    updated_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<FxRate EUR/{self.currency} = {self.rate} ({self.asof})>'
+
+
+class SessionRecord(db.Model):
+    """
+    Sessione lato server: il cookie contiene solo l'id firmato, i dati restano qui.
+    expires_at è indicizzato per rendere la pulizia periodica una semplice range delete.
+    """
+    sid = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True, index=True)  # per revocare tutte le sessioni di un utente
+    data = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False, index=True)  # epoch seconds
+
+    def __repr__(self):
+        return f'<Session {self.sid[:8]}… user={self.user_id}>'
+
+
+class AuditEvent(db.Model):
+    """
+    Log append-only degli eventi di sicurezza (login falliti, blocchi, PIN, reset password).
+    Scritto a batch da audit.py, mai aggiornato: lo stato derivato si ricostruisce col replay.
+    """
+    __table_args__ = (db.Index("ix_audit_event_user_ts", "user_id", "timestamp"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=True)  # niente FK: il log sopravvive all'utente
+    type = db.Column(db.String(40), nullable=False)  # es. 'login_failed', 'card_blocked'
+    ip = db.Column(db.String(45))
+    data = db.Column(db.Text)  # JSON con i dettagli dell'evento
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "timestamp": self.timestamp.isoformat(),
+            "user_id": self.user_id,
+            "type": self.type,
+            "ip": self.ip,
+            "data": json.loads(self.data) if self.data else {},
+        }
+
+    def __repr__(self):
+        return f'<AuditEvent {self.type} user={self.user_id} @ {self.timestamp}>'
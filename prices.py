@@ -14,7 +14,6 @@ Esempi veloci:
     price = get_crypto_price("bitcoin", "eur")
     print("BTC/EUR:", price)
 """
-from urllib.request import urlopen
 from urllib.parse import urlencode
 import json
 from datetime import datetime
@@ -23,6 +22,8 @@ class PriceError(Exception):
     """Errore generico per problemi di prezzo/API."""
 
 def _fetch_json(url: str) -> dict:
+    # import locale: urllib.request (http.client, ssl) serve solo quando si va in rete
+    from urllib.request import urlopen
     try:
         with urlopen(url, timeout=12) as resp:
             data = resp.read().decode("utf-8")
@@ -64,6 +65,32 @@ def get_fx_rate(base: str = "USD", quote: str = "EUR", provider: str = "frankfur
     else:
         raise ValueError('provider deve essere "frankfurter" o "exchangerate.host"')
 
+def get_fx_rates(base: str = "EUR", provider: str = "frankfurter"):
+    """
+    Ritorna (dizionario {valuta: tasso}, data_stringa) con tutti i cambi base→*.
+    Una sola chiamata HTTP per l'intera tabella (la base è inclusa con tasso 1.0).
+    provider: "frankfurter" (default) oppure "exchangerate.host".
+    """
+    base = base.upper().strip()
+
+    if provider == "frankfurter":
+        # https://api.frankfurter.app/latest?from=EUR
+        url = "https://api.frankfurter.app/latest?" + urlencode({"from": base})
+        js = _fetch_json(url)
+    elif provider == "exchangerate.host":
+        # https://api.exchangerate.host/latest?base=EUR
+        url = "https://api.exchangerate.host/latest?" + urlencode({"base": base})
+        js = _fetch_json(url)
+    else:
+        raise ValueError('provider deve essere "frankfurter" o "exchangerate.host"')
+
+    rates = js.get("rates")
+    if not rates:
+        raise PriceError(f"Nessun tasso per {base} nella risposta {provider}.")
+    rates = {cur.upper(): float(r) for cur, r in rates.items()}
+    rates[base] = 1.0
+    return rates, js.get("date")
+
 def get_crypto_price(coin_id: str = "bitcoin", vs: str = "usd"):
     """
     Ritorna il prezzo corrente (float) di una coin crypto rispetto a una valuta fiat.
@@ -81,6 +108,17 @@ def get_crypto_price(coin_id: str = "bitcoin", vs: str = "usd"):
         raise PriceError(f"Prezzo {coin_id}/{vs} non trovato nella risposta CoinGecko.")
     return float(js[coin_id][vs])
 
+def get_crypto_prices(coin_ids, vs: str = "usd"):
+    """
+    Ritorna {coin_id: prezzo} per più coin con una sola chiamata a CoinGecko.
+    Le coin assenti nella risposta vengono omesse.
+    """
+    ids = [c.strip().lower() for c in coin_ids if c.strip()]
+    vs = vs.strip().lower()
+    url = "https://api.coingecko.com/api/v3/simple/price?" + urlencode({"ids": ",".join(ids), "vs_currencies": vs})
+    js = _fetch_json(url)
+    return {c: float(js[c][vs]) for c in ids if c in js and vs in js[c]}
+
 if __name__ == "__main__":
     # Piccolo CLI: esegui
     #   python prices.py fx USD EUR
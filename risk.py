@@ -0,0 +1,280 @@
+"""
+risk.py — punteggio antifrode in tempo reale sui movimenti in uscita.
+
+Per ogni utente il motore tiene in memoria statistiche compatte aggiornate
+transazione per transazione:
+    - velocità: movimenti negli ultimi RISK_VELOCITY_WINDOW secondi
+    - importo: somma e somma dei quadrati degli importi (→ media, dev. std, z-score)
+    - destinatari: IBAN già usati in passato
+    - orario: istogramma delle 24 ore
+
+All'avvio lo stato viene ricostruito dallo storico Transaction con poche query
+aggregate (GROUP BY) invece di un ciclo riga per riga. Il punteggio di una
+richiesta legge solo la memoria: nessuna query sul percorso della richiesta.
+I movimenti di questo worker entrano nelle statistiche subito dopo il commit
+(observe_movement); quelli degli altri processi li applica un thread ogni
+RISK_SYNC_INTERVAL secondi, leggendo solo gli id successivi all'ultimo visto.
+"""
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+
+from models import Transaction, db
+
+ALLOW = "allow"
+FLAG = "flag"
+HOLD = "hold"
+
+
+class UserStats:
+    __slots__ = ("n", "s1", "s2", "recent", "recipients", "hours")
+
+    def __init__(self):
+        self.n = 0
+        self.s1 = 0.0
+        self.s2 = 0.0
+        self.recent = deque()  # epoch dei movimenti nella finestra di velocità
+        self.recipients = set()
+        self.hours = [0] * 24
+
+    def add(self, amount, ts, hour, recipient=None):
+        self.n += 1
+        self.s1 += amount
+        self.s2 += amount * amount
+        self.recent.append(ts)
+        self.hours[hour] += 1
+        if recipient:
+            self.recipients.add(recipient)
+
+    def std(self):
+        if self.n < 2:
+            return 0.0
+        mean = self.s1 / self.n
+        return math.sqrt(max(self.s2 / self.n - mean * mean, 0.0))
+
+
+class RiskAssessment:
+    __slots__ = ("score", "decision", "reasons")
+
+    def __init__(self, score, decision, reasons):
+        self.score = score
+        self.decision = decision
+        self.reasons = reasons
+
+    def __repr__(self):
+        return f'<RiskAssessment {self.decision} {self.score:.2f} {self.reasons}>'
+
+
+class RiskEngine:
+    # pesi dei segnali, sommati e limitati a 1.0
+    WEIGHTS = {"velocity": 0.4, "amount_zscore": 0.4, "new_recipient": 0.2, "unusual_hour": 0.2}
+
+    def __init__(self, velocity_window=600, velocity_limit=5, zscore_limit=3.0,
+                 flag_score=0.4, hold_score=0.8, min_history=5):
+        self.velocity_window = velocity_window
+        self.velocity_limit = velocity_limit
+        self.zscore_limit = zscore_limit
+        self.flag_score = flag_score
+        self.hold_score = hold_score
+        self.min_history = min_history
+        self.users = {}
+        self.last_id = 0
+        self.loaded = False
+        self._seen = set()  # id > last_id già applicati da record(): sync non li conta due volte
+        self._lock = threading.Lock()  # solo operazioni in memoria, mai query
+        self._rebuild_lock = threading.Lock()
+
+    def _stats(self, user_id):
+        stats = self.users.get(user_id)
+        if stats is None:
+            stats = self.users[user_id] = UserStats()
+        return stats
+
+    def _expire(self, stats, now):
+        horizon = now - self.velocity_window
+        while stats.recent and stats.recent[0] < horizon:
+            stats.recent.popleft()
+
+    # -----------------------------
+    # Scoring
+    # -----------------------------
+
+    def score(self, user_id, amount, when=None, recipient=None):
+        """Valuta un movimento in uscita (amount > 0) senza modificare lo stato."""
+        when = when or datetime.now()
+        now = when.timestamp()
+        stats = self.users.get(user_id) or UserStats()
+        self._expire(stats, now)
+
+        reasons = []
+        if len(stats.recent) >= self.velocity_limit:
+            reasons.append("velocity")
+        if stats.n >= self.min_history:
+            std = stats.std()
+            mean = stats.s1 / stats.n
+            if std > 0 and (amount - mean) / std > self.zscore_limit:
+                reasons.append("amount_zscore")
+            # orario mai (o quasi mai) usato da questo utente
+            if stats.hours[when.hour] / stats.n < 0.02:
+                reasons.append("unusual_hour")
+        if recipient and stats.n and recipient not in stats.recipients:
+            reasons.append("new_recipient")
+
+        score = min(1.0, sum(self.WEIGHTS[r] for r in reasons))
+        if score >= self.hold_score:
+            decision = HOLD
+        elif score >= self.flag_score:
+            decision = FLAG
+        else:
+            decision = ALLOW
+        return RiskAssessment(score, decision, reasons)
+
+    def observe(self, user_id, amount, when, recipient=None):
+        stats = self._stats(user_id)
+        stats.add(amount, when.timestamp(), when.hour, recipient)
+        self._expire(stats, time.time())
+
+    def record(self, tx_id, user_id, amount, when, recipient=None):
+        """Movimento in uscita appena committato da questo worker: conta subito, senza query."""
+        with self._lock:
+            if not self.loaded or tx_id <= self.last_id or tx_id in self._seen:
+                return  # lo applicherà (o l'ha già applicato) rebuild/sync
+            self._seen.add(tx_id)
+            self.observe(user_id, amount, when, recipient)
+
+    # -----------------------------
+    # Ricostruzione e sincronizzazione dallo storico
+    # -----------------------------
+
+    def rebuild(self):
+        """Ricostruisce tutte le statistiche con query aggregate sullo storico."""
+        T = Transaction
+        max_id = db.session.query(db.func.max(T.id)).scalar() or 0
+        outgoing = db.and_(T.amount < 0, T.id <= max_id)
+        users = {}
+
+        def stats(uid):
+            s = users.get(uid)
+            if s is None:
+                s = users[uid] = UserStats()
+            return s
+
+        for uid, n, s1, s2 in db.session.query(
+                T.user_id, db.func.count(), db.func.sum(-T.amount), db.func.sum(T.amount * T.amount)
+        ).filter(outgoing).group_by(T.user_id):
+            s = stats(uid)
+            s.n, s.s1, s.s2 = n, s1 or 0.0, s2 or 0.0
+
+        hour = db.func.strftime("%H", T.timestamp)
+        for uid, h, count in db.session.query(T.user_id, hour, db.func.count()) \
+                .filter(outgoing).group_by(T.user_id, hour):
+            stats(uid).hours[int(h)] = count
+
+        for uid, iban in db.session.query(T.user_id, T.counterparty_iban).distinct() \
+                .filter(outgoing, T.counterparty_iban.isnot(None)):
+            stats(uid).recipients.add(iban)
+
+        since = datetime.fromtimestamp(time.time() - self.velocity_window)
+        for uid, ts in db.session.query(T.user_id, T.timestamp) \
+                .filter(outgoing, T.timestamp >= since).order_by(T.timestamp):
+            stats(uid).recent.append(ts.timestamp())
+
+        with self._lock:
+            self.users = users
+            self.last_id = max_id
+            self._seen = set()
+            self.loaded = True
+        return len(users)
+
+    def ensure_loaded(self):
+        """Ricostruisce una sola volta anche con più richieste concorrenti; None se già fatto."""
+        with self._rebuild_lock:
+            if not self.loaded:
+                return self.rebuild()
+        return None
+
+    def sync(self):
+        """Applica le transazioni scritte dopo l'ultimo id visto (anche da altri worker); query fuori dal lock."""
+        if self.ensure_loaded() is not None:
+            return 0
+        t = Transaction.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(t.c.id, t.c.user_id, t.c.amount, t.c.timestamp, t.c.counterparty_iban)
+                .where(t.c.id > self.last_id).order_by(t.c.id)
+            ).all()
+        with self._lock:
+            for tx_id, uid, amount, ts, iban in rows:
+                if tx_id <= self.last_id:
+                    continue  # già applicata da un sync concorrente
+                if amount < 0 and tx_id not in self._seen:
+                    self.observe(uid, -amount, ts, iban)
+                self.last_id = tx_id
+            self._seen = {tx_id for tx_id in self._seen if tx_id > self.last_id}
+        return len(rows)
+
+    def assess(self, user_id, amount, recipient=None):
+        if not self.loaded:
+            self.ensure_loaded()
+        with self._lock:
+            return self.score(user_id, amount, recipient=recipient)
+
+
+class RiskSyncer(threading.Thread):
+    """Ricostruzione iniziale in background, poi applica ogni interval secondi i movimenti degli altri worker."""
+
+    def __init__(self, app, engine, interval=1.0):
+        super().__init__(name="risk-sync", daemon=True)
+        self.app = app
+        self.engine = engine
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        with self.app.app_context():
+            try:
+                count = self.engine.ensure_loaded()
+                if count is not None:
+                    self.app.logger.info("Risk engine: statistiche ricostruite per %d utenti", count)
+            except Exception as e:
+                self.app.logger.warning("Ricostruzione risk engine fallita: %s", e)
+            finally:
+                db.session.remove()
+            while not self._stop_event.wait(self.interval):
+                try:
+                    self.engine.sync()
+                except Exception as e:
+                    self.app.logger.warning("Sincronizzazione risk engine fallita: %s", e)
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def init_app(app):
+    engine = RiskEngine(
+        velocity_window=app.config.get("RISK_VELOCITY_WINDOW", 600),
+        velocity_limit=app.config.get("RISK_VELOCITY_LIMIT", 5),
+        zscore_limit=app.config.get("RISK_ZSCORE_LIMIT", 3.0),
+        flag_score=app.config.get("RISK_FLAG_SCORE", 0.4),
+        hold_score=app.config.get("RISK_HOLD_SCORE", 0.8),
+    )
+    app.extensions["risk"] = engine
+    app.extensions.setdefault("background_workers", []).append(
+        RiskSyncer(app, engine, app.config.get("RISK_SYNC_INTERVAL", 1.0)))
+    return engine
+
+
+def assess_movement(user_id, amount, recipient=None):
+    """Punteggio di un movimento in uscita, da chiamare prima del commit."""
+    return current_app.extensions["risk"].assess(user_id, amount, recipient=recipient)
+
+
+def observe_movement(tx_id, user_id, amount, when, recipient=None):
+    """Da chiamare dopo il commit di un movimento in uscita (amount > 0) valutato con assess_movement."""
+    current_app.extensions["risk"].record(tx_id, user_id, amount, when, recipient)
@@ -1,15 +1,23 @@
+import hmac
 import json
 import random
 import string
-import smtplib
 from datetime import datetime, time, timedelta
-from email.mime.text import MIMEText
 from flask import jsonify, render_template, request, redirect, session, url_for, flash, Response, Blueprint, current_app as app
-import requests
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import CryptoPriceHistory, CryptoTrade, db, User, Transaction, Card
-from prices import PriceError, get_crypto_price, get_fx_rate
-from utility import generate_iban, send_otp, generate_card, send_security_alert, fetch_crypto_price,get_crypto_price
+from models import CryptoOrder, CryptoPriceHistory, PriceAlert, CryptoTrade, db, User, Transaction, Card
+from prices import PriceError, get_crypto_price
+from fx import SUPPORTED_CURRENCIES, rate_table
+from alerts import create_alert, delete_alert
+from audit import record_event
+from caching import conditional
+from cards import APPROVED, VERIFICATION_FAILED, SUSPECTED_FRAUD, INVALID_AMOUNT, capture, get_index, register_verification_failure, set_card_blocked
+from risk import FLAG, HOLD, assess_movement, observe_movement
+from market import get_feed
+from search import search_transactions
+from sessions import revoke_user_sessions
+from trading import LIMIT, MARKET, OPEN, TradeError, cancel_order, place_order
+from utility import change_balance, generate_iban, send_otp, check_otp, generate_card, send_security_alert, send_mail
 
 from itsdangerous import URLSafeTimedSerializer
 
@@ -27,11 +35,54 @@ def init_app(app):
     app.register_blueprint(bp)
 
 
+# -----------------------------
+# Cache validators
+# -----------------------------
+
+def _static_page():
+    return "static"
+
+def _logged_in_page():
+    if "user_id" not in session:
+        return None
+    return "static"
+
+def _ledger_page():
+    """Versione del conto: ultimo movimento + saldo, con una query sull'indice user_id."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    user = db.session.get(User, user_id)
+    if user is None or not user.pin:
+        return None
+    last_id = db.session.query(db.func.max(Transaction.id)).filter(Transaction.user_id == user_id).scalar()
+    card = Card.query.filter_by(user_id=user_id).first()
+    return last_id, user.balance, user.currency, card.blocked if card else None
+
+def _investments_page():
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    symbol = request.args.get("symbol", "bitcoin")
+    last_trade = db.session.query(db.func.max(CryptoTrade.id)) \
+        .filter(CryptoTrade.user_id == user_id, CryptoTrade.symbol == symbol).scalar()
+    # ordini: nuovi (max id) o chiusi da un tick/annullati (numero di aperti)
+    last_order, open_orders = db.session.query(
+        db.func.max(CryptoOrder.id), db.func.sum(db.case((CryptoOrder.status == OPEN, 1), else_=0))
+    ).filter(CryptoOrder.user_id == user_id).one()
+    # avvisi: nuovi (max id), eliminati (conteggio) o scattati (ultimo triggered_at)
+    last_alert, alert_count, triggered_alerts = db.session.query(
+        db.func.max(PriceAlert.id), db.func.count(PriceAlert.id), db.func.max(PriceAlert.triggered_at)
+    ).filter(PriceAlert.user_id == user_id).one()
+    return last_trade, last_order, open_orders, last_alert, alert_count, triggered_alerts
+
+
 # -----------------------------
 # Routes
 # -----------------------------
 
 @bp.route("/")
+@conditional(_static_page)
 def index():
     return render_template("index.html")
 
@@ -41,6 +92,11 @@ def register():
         name = request.form["name"]
         email = request.form["email"]
         password = request.form["password"]
+        currency = request.form.get("currency", "EUR").upper()
+
+        if currency not in SUPPORTED_CURRENCIES:
+            flash("Valuta non supportata!")
+            return redirect(url_for("routes.register"))
         
         existing_user = User.query.filter((User.email == email)).first()
         if existing_user:
@@ -50,7 +106,7 @@ def register():
         hashed_pw = generate_password_hash(password)
         generated_iban = generate_iban() 
 
-        new_user = User(name=name, email=email, password=hashed_pw, balance=0, iban=generated_iban)
+        new_user = User(name=name, email=email, password=hashed_pw, balance=0, iban=generated_iban, currency=currency)
         db.session.add(new_user)
         db.session.commit()
 
@@ -60,7 +116,7 @@ def register():
 
         flash("Registrazione avvenuta con successo! Imposta il tuo PIN.")
         return redirect(url_for("routes.set_pin"))
-    return render_template("register.html")
+    return render_template("register.html", currencies=SUPPORTED_CURRENCIES)
 
 @bp.route("/login", methods=["GET", "POST"])
 def login():
@@ -74,6 +130,7 @@ def login():
             return redirect(url_for("routes.login"))
 
         if user.is_locked():
+            record_event("login_rejected_locked", user.id)
             unlock_time = user.locked_until.strftime("%H:%M:%S")
             flash(f"Account bloccato fino alle {unlock_time}.")
             return render_template("login.html")
@@ -82,6 +139,7 @@ def login():
         if user and check_password_hash(user.password, password):
             user.failed_attempts=0
             db.session.commit()
+            record_event("login_succeeded", user.id, stage="password")
             session["temp_user_id"] = user.id
             send_otp(user.email)
             return redirect(url_for("routes.verify_otp"))
@@ -91,6 +149,7 @@ def login():
 
         client_ip = request.remote_addr
         client_ua = request.headers.get('User-Agent')
+        record_event("login_failed", user.id, attempts=user.failed_attempts, user_agent=client_ua)
         # Invia mail al primo tentativo fallito (configurabile)
          
         if user.failed_attempts == 1:
@@ -99,6 +158,7 @@ def login():
         if user.failed_attempts >= 3:
             user.locked_until = datetime.now() + timedelta(minutes=5)  # lock 5 min
             db.session.commit()
+            record_event("account_locked", user.id, locked_until=user.locked_until.isoformat())
             # Invia mail anche al momento del lock con l'informazione del blocco
             send_security_alert(user.email, ip=client_ip, user_agent=client_ua, attempts=user.failed_attempts, locked_until=user.locked_until)
             flash("Troppi tentativi falliti. Account bloccato per 5 minuti.", "error")
@@ -115,6 +175,7 @@ def logout():
     return redirect(url_for("routes.index"))
 
 @bp.route("/dashboard")
+@conditional(_ledger_page)
 def dashboard():
     user_id = session.get("user_id")
     user = User.query.get_or_404(user_id)
@@ -134,8 +195,7 @@ def transaction():
 
     user = User.query.get_or_404(session["user_id"])
 
-    card = Card.query.filter_by(user_id=user.id).first()
-    if card and card.blocked:
+    if get_index(app).first_card_blocked(user.id):
         flash("Operazione non consentita: la tua carta è bloccata.")
         return redirect(url_for("routes.dashboard"))
 
@@ -167,37 +227,112 @@ def transaction():
         flash("PIN errato!")
         return redirect(url_for("routes.transaction", type=t_type))
 
+    assessment = None
+    if t_type == "withdraw":
+        assessment = assess_movement(user.id, amount)
+        if assessment.decision == HOLD:
+            record_event("risk_hold", user.id, kind=t_type, amount=amount, score=assessment.score, reasons=assessment.reasons)
+            flash("Operazione sospesa per verifica di sicurezza. Contatta il supporto.", "error")
+            return redirect(url_for("routes.dashboard"))
+
     if t_type == "deposit":
-        user.balance += amount
         signed_amount = amount
     elif t_type == "withdraw":
-        user.balance -= amount
         signed_amount = -amount
     else:
         flash("Tipo di operazione non valido!")
         return redirect(url_for("routes.dashboard"))
 
+    # UPDATE atomico: un pagamento carta o un ordine eseguito nel frattempo non va perso
+    balance_after = change_balance(user.id, signed_amount)
+    if balance_after is None:
+        db.session.rollback()
+        flash("Fondi insufficienti per il prelievo!")
+        return redirect(url_for("routes.dashboard", type="withdraw"))
+
     new_transaction = Transaction(
         amount=signed_amount,
         timestamp=datetime.now(),
         type=t_type,
         user_id=user.id,
-        balance_after=user.balance
+        balance_after=balance_after,
+        risk_score=assessment.score if assessment else None
     )
     db.session.add(new_transaction)
+    db.session.flush()
+    tx_id, tx_time = new_transaction.id, new_transaction.timestamp
     db.session.commit()
+    if assessment:
+        observe_movement(tx_id, user.id, amount, tx_time)
+        if assessment.decision == FLAG:
+            record_event("risk_flagged", user.id, transaction_id=tx_id, score=assessment.score, reasons=assessment.reasons)
 
-    flash(f"{'Deposito' if t_type=='deposit' else 'Prelievo'} di {amount:.2f} € effettuato con successo!")
+    flash(f"{'Deposito' if t_type=='deposit' else 'Prelievo'} di {amount:.2f} {user.currency} effettuato con successo!")
     return redirect(url_for("routes.dashboard"))
 
+def _search_filters():
+    """Legge i filtri di ricerca dalla query string; ValueError se un valore non è valido."""
+    def amount(name):
+        value = request.args.get(name, "").strip()
+        return float(value) if value else None
+
+    def day(name):
+        value = request.args.get(name, "").strip()
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+
+    date_to = day("date_to")
+    return {
+        "text": request.args.get("q", "").strip() or None,
+        "category": request.args.get("category", "").strip() or None,
+        "min_amount": amount("min_amount"),
+        "max_amount": amount("max_amount"),
+        "date_from": day("date_from"),
+        "date_to": date_to + timedelta(days=1) if date_to else None,  # giorno finale incluso
+    }
+
 @bp.route("/transactions")
+@conditional(_ledger_page)
 def transactions():
     if "user_id" not in session:
         return redirect(url_for("routes.login"))
     user_id = session["user_id"]
     user = User.query.get_or_404(user_id)
-    transactions = Transaction.query.filter_by(user_id=user_id).order_by(Transaction.timestamp.desc()).all()
-    return render_template("transactions.html", user=user, transactions=transactions)
+    try:
+        filters = _search_filters()
+    except ValueError:
+        flash("Filtri di ricerca non validi!", "error")
+        return redirect(url_for("routes.transactions"))
+    if any(v is not None for v in filters.values()):
+        transactions = search_transactions(user_id, limit=500, **filters)
+    else:
+        transactions = Transaction.query.filter_by(user_id=user_id).order_by(Transaction.timestamp.desc()).all()
+    return render_template("transactions.html", user=user, transactions=transactions, filters=request.args)
+
+@bp.route("/api/transactions/search")
+def api_search_transactions():
+    """Ricerca nello storico: q, category, min_amount, max_amount, date_from, date_to, limit, offset."""
+    if "user_id" not in session:
+        return jsonify({"error": "Non autenticato"}), 401
+    try:
+        filters = _search_filters()
+        limit = int(request.args.get("limit", 100))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    results = search_transactions(session["user_id"], limit=limit, offset=offset, **filters)
+    return jsonify({
+        "results": [
+            {
+                "id": t.id,
+                "timestamp": t.timestamp.isoformat(),
+                "type": t.type,
+                "category": t.category,
+                "amount": t.amount,
+                "balance_after": t.balance_after,
+                "details": t.details,
+            } for t in results
+        ]
+    })
 
 @bp.route("/transfer", methods=["GET", "POST"])
 def transfer():
@@ -241,34 +376,69 @@ def transfer():
 
         recipient = User.query.filter_by(iban=recipient_iban).first()
 
-        sender.balance -= amount
+        assessment = assess_movement(sender.id, amount, recipient=recipient_iban)
+        if assessment.decision == HOLD:
+            record_event("risk_hold", sender.id, kind="transfer", amount=amount, iban=recipient_iban,
+                         score=assessment.score, reasons=assessment.reasons)
+            flash("Trasferimento sospeso per verifica di sicurezza. Contatta il supporto.", "error")
+            return redirect(url_for("routes.transfer"))
+
+        # conversione al momento del trasferimento, solo cache in memoria (niente rete)
+        credited = amount
+        fx_note = ""
+        if recipient and recipient.currency != sender.currency:
+            try:
+                credited, rate = rate_table.convert(amount, sender.currency, recipient.currency)
+            except PriceError:
+                flash("Tasso di cambio non disponibile, riprova più tardi.")
+                return redirect(url_for("routes.transfer"))
+            fx_note = f" [1 {sender.currency} = {rate:.4f} {recipient.currency}]"
+
+        # saldi con UPDATE atomici: addebiti concorrenti (carta, ordini crypto) non vanno persi
+        sender_balance = change_balance(sender.id, -amount)
+        if sender_balance is None:
+            db.session.rollback()
+            flash("Saldo insufficiente!")
+            return redirect(url_for("routes.transfer"))
 
         # sender
-        db.session.add(Transaction(
+        outgoing = Transaction(
             amount=-amount,
+            timestamp=datetime.now(),
             type="transfer",
             category="trasferimento IBAN in uscita",
             user_id=sender.id,
-            balance_after=sender.balance,
-            details=f"a {recipient.name if recipient else 'IBAN esterno'} ({recipient_iban})"
-        ))
+            balance_after=sender_balance,
+            details=f"a {recipient.name if recipient else 'IBAN esterno'} ({recipient_iban}){fx_note}",
+            counterparty_iban=recipient_iban,
+            risk_score=assessment.score
+        )
+        db.session.add(outgoing)
 
         # recipient
         if recipient:
-            recipient.balance += amount
             db.session.add(Transaction(
-                amount=amount,
+                amount=credited,
                 type="transfer",
                 category="trasferimento IBAN in entrata",
                 user_id=recipient.id,
-                balance_after=recipient.balance,
-                details=f"da {sender.name} ({sender.iban or 'IBAN non disp.'})"
+                balance_after=change_balance(recipient.id, credited),
+                details=f"da {sender.name} ({sender.iban or 'IBAN non disp.'}){fx_note}",
+                counterparty_iban=sender.iban
             ))
-            flash(f"Trasferiti {amount:.2f} € a {recipient.name}!")
+            if credited != amount:
+                flash(f"Trasferiti {amount:.2f} {sender.currency} ({credited:.2f} {recipient.currency}) a {recipient.name}!")
+            else:
+                flash(f"Trasferiti {amount:.2f} {sender.currency} a {recipient.name}!")
         else:
-            flash(f"Trasferimento di {amount:.2f} € verso l'IBAN esterno {recipient_iban} eseguito con successo!")
+            flash(f"Trasferimento di {amount:.2f} {sender.currency} verso l'IBAN esterno {recipient_iban} eseguito con successo!")
 
+        db.session.flush()
+        tx_id, tx_time = outgoing.id, outgoing.timestamp
         db.session.commit()
+        observe_movement(tx_id, sender.id, amount, tx_time, recipient_iban)
+        if assessment.decision == FLAG:
+            record_event("risk_flagged", sender.id, transaction_id=tx_id, score=assessment.score, reasons=assessment.reasons)
         return redirect(url_for("routes.dashboard"))
 
     return render_template("transfer.html", user=sender)
@@ -285,6 +455,7 @@ def set_pin():
         if pin:
             user.pin = generate_password_hash(pin)
             db.session.commit()
+            record_event("pin_set", user.id)
             flash("PIN impostato con successo!")
             return redirect(url_for("routes.dashboard"))
         else:
@@ -295,15 +466,26 @@ def set_pin():
 @bp.route("/verify_otp", methods=["GET", "POST"])
 def verify_otp():
     if request.method == "POST":
-        otp = request.form.get("otp")
-        if otp == session.get("otp"):
-            session.pop("otp")
+        otp = request.form.get("otp", "")
+        result = check_otp(otp)
+        if result == "ok":
+            record_event("login_completed", session.get("temp_user_id"), stage="otp")
             session["user_id"] = session.get("temp_user_id")
             session.pop("temp_user_id")
+            # nuovo id di sessione dopo l'autenticazione (session fixation)
+            session.regenerate()
             flash("Login completato con 2FA!")
             return redirect(url_for("routes.dashboard"))
-        else:
+        elif result == "invalid":
+            record_event("otp_invalid", session.get("temp_user_id"))
             flash("Codice OTP errato.")
+        else:
+            record_event("otp_" + result, session.pop("temp_user_id", None))
+            if result == "locked":
+                flash("Troppi tentativi OTP errati. Effettua di nuovo il login.", "error")
+            else:
+                flash("Codice OTP scaduto. Effettua di nuovo il login.", "error")
+            return redirect(url_for("routes.login"))
     return render_template("verify_otp.html")
 
 @bp.route("/block_card/<int:card_id>", methods=["POST"])
@@ -317,8 +499,8 @@ def block_card(card_id):
         flash("Accesso non autorizzato.")
         return redirect(url_for("routes.dashboard"))
 
-    card.blocked = True
-    db.session.commit()
+    set_card_blocked(get_index(app), card, True)
+    record_event("card_blocked", card.user_id, card_id=card.id)
     flash("Carta bloccata con successo.")
     return redirect(url_for("routes.show_card", card_id=card.id))
 
@@ -333,8 +515,8 @@ def unblock_card(card_id):
         flash("Accesso non autorizzato.")
         return redirect(url_for("routes.dashboard"))
 
-    card.blocked = False
-    db.session.commit()
+    set_card_blocked(get_index(app), card, False)
+    record_event("card_unblocked", card.user_id, card_id=card.id)
     flash("Carta sbloccata con successo.")
     return redirect(url_for("routes.show_card", card_id=card.id))
 
@@ -360,6 +542,51 @@ def show_card(card_id):
 
     return render_template("show_card.html", card=card, user=user, show_cvv=False)
 
+@bp.route("/api/cards/authorize", methods=["POST"])
+def authorize_card():
+    """
+    Autorizzazione POS/ATM simulata. JSON: number, expiry (MM/YY), cvv, amount, merchant.
+    Richiede l'header X-Terminal-Key uguale a CARD_TERMINAL_KEY; senza chiave
+    configurata l'endpoint risponde 503.
+    """
+    terminal_key = app.config.get("CARD_TERMINAL_KEY")
+    if not terminal_key:
+        return jsonify({"error": "Autorizzazioni carta non configurate"}), 503
+    if not hmac.compare_digest(request.headers.get("X-Terminal-Key", "").encode(), terminal_key.encode()):
+        return jsonify({"error": "Terminale non autorizzato"}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        amount = round(float(data.get("amount", 0)), 2)
+    except (TypeError, ValueError):
+        amount = 0
+    if amount <= 0:
+        return jsonify({"approved": False, "code": INVALID_AMOUNT})
+
+    index = get_index(app)
+    code, state = index.check(str(data.get("number", "")), str(data.get("expiry", "")), str(data.get("cvv", "")))
+    tx_id = None
+    if code == VERIFICATION_FAILED:
+        if register_verification_failure(index, state, app.config.get("CARD_MAX_CVV_FAILURES", 3)):
+            record_event("card_blocked", state.user_id, card_id=state.card_id, reason="verification_failures")
+    elif code == APPROVED:
+        assessment = assess_movement(state.user_id, amount)
+        if assessment.decision == HOLD:
+            record_event("risk_hold", state.user_id, kind="card", amount=amount, card_id=state.card_id,
+                         score=assessment.score, reasons=assessment.reasons)
+            code = SUSPECTED_FRAUD
+        else:
+            code, tx_id = capture(state, amount, data.get("merchant"), risk_score=assessment.score)
+            if tx_id is not None:
+                observe_movement(tx_id, state.user_id, amount, datetime.now())
+                if assessment.decision == FLAG:
+                    record_event("risk_flagged", state.user_id, transaction_id=tx_id,
+                                 score=assessment.score, reasons=assessment.reasons)
+    if state is not None and code != APPROVED:
+        record_event("card_declined", state.user_id, card_id=state.card_id, code=code, amount=amount)
+
+    return jsonify({"approved": code == APPROVED, "code": code, "transaction_id": tx_id})
+
 @bp.route("/cards")
 def show_user_cards():
     if "user_id" not in session:
@@ -383,16 +610,10 @@ def forgot_password():
             
             # Send email with the token
             reset_url = url_for('routes.reset_password', token=token, _external=True)
-            msg = MIMEText(f"Per resettare la tua password, clicca sul seguente link: {reset_url}. Il link scade tra 1 ora.", "plain", "utf-8")
-            msg["Subject"] = "Richiesta di reset password"
-            msg["From"] = app.config['EMAIL_USER']
-            msg["To"] = email
-            
+            record_event("password_reset_requested", user.id)
             try:
-                with smtplib.SMTP("smtp.gmail.com", 587) as server:
-                    server.starttls()
-                    server.login(app.config['EMAIL_USER'], app.config['EMAIL_PASS'])
-                    server.sendmail(app.config['EMAIL_USER'], email, msg.as_string())
+                send_mail(email, "Richiesta di reset password",
+                          f"Per resettare la tua password, clicca sul seguente link: {reset_url}. Il link scade tra 1 ora.")
                 flash("Una email con le istruzioni per il reset della password è stata inviata.", "success")
             except Exception as e:
                 flash(f"Errore nell'invio dell'email: {e}", "error")
@@ -425,12 +646,16 @@ def reset_password(token):
         
         user.password = generate_password_hash(password)
         db.session.commit()
+        # chi conosceva la vecchia password non deve restare loggato
+        revoke_user_sessions(app, user.id)
+        record_event("password_reset", user.id)
         flash("La tua password è stata resettata con successo. Ora puoi effettuare il login.", "success")
         return redirect(url_for('routes.login'))
     
     return render_template("reset_password.html", token=token)
 
 @bp.route("/settings")
+@conditional(_logged_in_page)
 def settings():
     if "user_id" not in session:
         flash("Devi accedere per entrare nelle impostazioni.", "error")
@@ -463,6 +688,7 @@ def set_new_password():
         
         user.password= generate_password_hash(new_password)
         db.session.commit()
+        record_event("password_changed", user.id)
 
         flash("password aggiornata con successo!")
         return redirect(url_for("routes.settings"))
@@ -471,6 +697,7 @@ def set_new_password():
 
 
 @bp.route("/investments", methods=["GET", "POST"])
+@conditional(_investments_page)
 def investments():
     user = User.query.get(session["user_id"])
     # se il form POST manda un symbol, usalo; altrimenti default
@@ -486,8 +713,11 @@ def investments():
         
         # This is an actual trade submission
         side = request.form["side"]
+        order_type = request.form.get("order_type", MARKET)
+        limit_str = request.form.get("limit_price", "").strip()
         try:
             amount = float(amount_str)
+            limit_price = float(limit_str) if order_type == LIMIT and limit_str else None
         except ValueError:
             flash("Importo non valido!", "error")
             return redirect(url_for("routes.investments", symbol=symbol))
@@ -497,21 +727,20 @@ def investments():
             return redirect(url_for("routes.investments", symbol=symbol))
         
         try:
-            price = get_crypto_price(symbol)
-        except Exception:
+            order = place_order(user, symbol, side, amount, order_type, limit_price)
+        except TradeError as e:
+            flash(str(e), "error")
+            return redirect(url_for("routes.investments", symbol=symbol))
+        except PriceError:
             flash("Errore recupero prezzo", "error")
             return redirect(url_for("routes.investments", symbol=symbol))
 
-        trade = CryptoTrade(
-            user_id=user.id,
-            symbol=symbol,
-            side=side,
-            amount=amount,
-            price=price
-        )
-        db.session.add(trade)
-        db.session.commit()
-        flash("Trade salvato!", "success")
+        if order.status == "filled":
+            flash(f"Ordine eseguito a ${order.fill_price:,.2f}", "success")
+        elif order.status == "rejected":
+            flash(f"Ordine rifiutato: {order.reason}", "error")
+        else:
+            flash("Ordine limit inserito, verrà eseguito al raggiungimento del prezzo.", "success")
         # redirect con query param per restare sulla stessa moneta
         return redirect(url_for("routes.investments", symbol=symbol))
 
@@ -525,9 +754,55 @@ def investments():
         } for t in trades
     ])
 
+    open_orders = CryptoOrder.query.filter_by(user_id=user.id, status=OPEN) \
+        .order_by(CryptoOrder.created_at.desc()).all()
+
+    price_alerts = PriceAlert.query.filter_by(user_id=user.id) \
+        .order_by(PriceAlert.created_at.desc()).limit(20).all()
+
     return render_template("investments.html",
                            symbol=symbol,
-                           trades_json=trades_json)
+                           trades_json=trades_json,
+                           open_orders=open_orders,
+                           price_alerts=price_alerts)
+
+
+@bp.route("/investments/alerts", methods=["POST"])
+def add_price_alert():
+    if "user_id" not in session:
+        return redirect(url_for("routes.login"))
+    user = db.session.get(User, session["user_id"])
+    symbol = request.form.get("symbol", "bitcoin")
+    try:
+        create_alert(user, symbol, request.form.get("direction", ""), float(request.form.get("threshold", "")))
+    except ValueError as e:
+        flash(f"Avviso non valido: {e}", "error")
+    else:
+        flash("Avviso di prezzo salvato: riceverai una email quando scatta.", "success")
+    return redirect(url_for("routes.investments", symbol=symbol))
+
+
+@bp.route("/investments/alerts/<int:alert_id>/delete", methods=["POST"])
+def delete_price_alert(alert_id):
+    if "user_id" not in session:
+        return redirect(url_for("routes.login"))
+    alert = PriceAlert.query.filter_by(id=alert_id, user_id=session["user_id"]).first_or_404()
+    symbol = alert.symbol
+    delete_alert(alert)
+    flash("Avviso eliminato.", "success")
+    return redirect(url_for("routes.investments", symbol=symbol))
+
+
+@bp.route("/investments/orders/<int:order_id>/cancel", methods=["POST"])
+def cancel_crypto_order(order_id):
+    if "user_id" not in session:
+        return redirect(url_for("routes.login"))
+    order = CryptoOrder.query.filter_by(id=order_id, user_id=session["user_id"]).first_or_404()
+    if cancel_order(order):
+        flash("Ordine annullato.", "success")
+    else:
+        flash("L'ordine non è più aperto.", "error")
+    return redirect(url_for("routes.investments", symbol=order.symbol))
 
 
 @bp.route("/api/crypto/<symbol>")
@@ -535,22 +810,25 @@ def api_crypto(symbol):
     """
     Recupera il prezzo corrente, lo salva nel DB e restituisce la cronologia.
     """
-    # 1. Ottieni il prezzo corrente
-    try:
-        current_price = get_crypto_price(symbol)
-    except Exception:
-        return jsonify({"error": "Errore nel recupero del prezzo della crypto"}), 500
+    # 1. Ottieni il prezzo corrente (se il poller l'ha già salvato di recente, niente chiamata)
+    feed = get_feed(app)
+    if feed.latest(symbol, app.config.get("MARKET_POLL_INTERVAL", 15)) is None:
+        try:
+            current_price = get_crypto_price(symbol)
+        except Exception:
+            return jsonify({"error": "Errore nel recupero del prezzo della crypto"}), 500
 
-    now = datetime.now()
+        now = datetime.now()
 
-    # 2. Salva il nuovo punto nel database
-    new_data_point = CryptoPriceHistory(
-        symbol=symbol,
-        price=current_price,
-        timestamp=now
-    )
-    db.session.add(new_data_point)
-    db.session.commit()
+        # 2. Salva il nuovo punto nel database e notificalo (ordini limit, ...)
+        new_data_point = CryptoPriceHistory(
+            symbol=symbol,
+            price=current_price,
+            timestamp=now
+        )
+        db.session.add(new_data_point)
+        db.session.commit()
+        feed.publish(symbol, current_price, now, logger=app.logger)
 
     # 3. Recupera la cronologia (limitata)
     # Recupera gli ultimi N punti per il simbolo corrente
@@ -0,0 +1,133 @@
+"""
+search.py — ricerca nello storico delle transazioni.
+
+- Testo libero su details/category tramite una tabella virtuale SQLite FTS5
+  (transaction_fts) senza contenuto proprio: contiene solo l'indice, con rowid =
+  Transaction.id. La colonna "owner" (token "u<user_id>") limita il MATCH alle
+  righe dell'utente direttamente dentro l'indice full-text.
+- I trigger SQLite tengono l'indice allineato su INSERT/UPDATE/DELETE, qualunque
+  sia il percorso di scrittura (route, import massivi, script). Per i caricamenti
+  da milioni di righe bulk_load() li sospende e indicizza tutto alla fine.
+- I filtri strutturati (importo, date, categoria) usano gli indici composti
+  definiti su Transaction.
+"""
+import re
+from contextlib import contextmanager
+
+from models import Transaction, db
+
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS transaction_fts USING fts5(
+        details, category, owner, content='', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS transaction_fts_ai AFTER INSERT ON "transaction" BEGIN
+        INSERT INTO transaction_fts(rowid, details, category, owner)
+        VALUES (new.id, new.details, new.category, 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transaction_fts_ad AFTER DELETE ON "transaction" BEGIN
+        INSERT INTO transaction_fts(transaction_fts, rowid, details, category, owner)
+        VALUES ('delete', old.id, old.details, old.category, 'u' || old.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transaction_fts_au AFTER UPDATE OF details, category, user_id ON "transaction" BEGIN
+        INSERT INTO transaction_fts(transaction_fts, rowid, details, category, owner)
+        VALUES ('delete', old.id, old.details, old.category, 'u' || old.user_id);
+        INSERT INTO transaction_fts(rowid, details, category, owner)
+        VALUES (new.id, new.details, new.category, 'u' || new.user_id);
+    END""",
+]
+
+FTS_TRIGGERS = ("transaction_fts_ai", "transaction_fts_ad", "transaction_fts_au")
+
+MAX_RESULTS = 500
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def init_db():
+    """Crea tabella FTS e trigger se mancano; al primo avvio indicizza lo storico esistente."""
+    with db.engine.begin() as conn:
+        existed = conn.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='transaction_fts'"
+        )).first() is not None
+        for ddl in FTS_DDL:
+            conn.execute(db.text(ddl))
+        if not existed:
+            conn.execute(db.text(
+                """INSERT INTO transaction_fts(rowid, details, category, owner)
+                   SELECT id, details, category, 'u' || user_id FROM "transaction" """
+            ))
+
+
+@contextmanager
+def bulk_load():
+    """
+    Sospende i trigger FTS durante un caricamento massivo (un INSERT per riga
+    nell'indice costa più dell'insert stesso) e alla fine indicizza con un solo
+    INSERT ... SELECT le transazioni con id successivo a quello di partenza.
+    Da usare a server fermo: UPDATE/DELETE fatti nel frattempo non verrebbero indicizzati.
+    """
+    with db.engine.begin() as conn:
+        start_id = conn.execute(db.text('SELECT COALESCE(MAX(id), 0) FROM "transaction"')).scalar()
+        for name in FTS_TRIGGERS:
+            conn.execute(db.text(f"DROP TRIGGER IF EXISTS {name}"))
+    try:
+        yield
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(db.text(
+                """INSERT INTO transaction_fts(rowid, details, category, owner)
+                   SELECT id, details, category, 'u' || user_id FROM "transaction" WHERE id > :start_id"""
+            ), {"start_id": start_id})
+            for ddl in FTS_DDL[1:]:
+                conn.execute(db.text(ddl))
+
+
+def build_match(text, user_id):
+    """
+    Converte il testo dell'utente in una query FTS5 sicura: ogni parola diventa
+    un prefisso tra virgolette, tutte obbligatorie, cercate in details e category.
+    """
+    words = _WORD.findall(text or "")
+    if not words:
+        return None
+    terms = " ".join('"{}"*'.format(w.replace('"', '""')) for w in words)
+    return f"owner:u{int(user_id)} AND {{details category}}: ({terms})"
+
+
+def search_transactions(user_id, text=None, category=None, min_amount=None, max_amount=None,
+                        date_from=None, date_to=None, limit=100, offset=0):
+    """
+    Transazioni dell'utente filtrate, più recenti per prime.
+    min_amount/max_amount si riferiscono all'importo in valore assoluto
+    (entrate e uscite), date_to è esclusivo.
+    """
+    query = Transaction.query.filter(Transaction.user_id == user_id)
+
+    match = build_match(text, user_id)
+    if match:
+        fts_ids = db.select(db.column("rowid")).select_from(db.table("transaction_fts")) \
+            .where(db.text("transaction_fts MATCH :fts_query").bindparams(fts_query=match))
+        query = query.filter(Transaction.id.in_(fts_ids))
+
+    if category:
+        query = query.filter(Transaction.category == category)
+
+    if min_amount is not None or max_amount is not None:
+        # due range sul valore con segno invece di abs(amount): restano sull'indice (user_id, amount)
+        low = min_amount if min_amount is not None else 0.0
+        if max_amount is None:
+            query = query.filter(db.or_(Transaction.amount >= low, Transaction.amount <= -low))
+        else:
+            query = query.filter(db.or_(
+                Transaction.amount.between(low, max_amount),
+                Transaction.amount.between(-max_amount, -low),
+            ))
+
+    if date_from is not None:
+        query = query.filter(Transaction.timestamp >= date_from)
+    if date_to is not None:
+        query = query.filter(Transaction.timestamp < date_to)
+
+    limit = max(1, min(int(limit), MAX_RESULTS))
+    return query.order_by(Transaction.timestamp.desc(), Transaction.id.desc()) \
+        .offset(max(0, int(offset))).limit(limit).all()
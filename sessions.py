@@ -0,0 +1,389 @@
+"""
+sessions.py — sessioni Flask lato server.
+
+Il cookie contiene solo l'id di sessione firmato; i dati (utente loggato, OTP,
+messaggi flash) restano sul server, così le sessioni si possono revocare,
+contare e condividere tra più worker. Ogni richiesta fa un solo lookup per chiave.
+
+Backend disponibili (config SESSION_BACKEND):
+    "memory"  — dizionario in processo (sviluppo / worker singolo)
+    "sqlite"  — tabella SessionRecord con scadenza indicizzata e pulizia periodica
+    "shared"  — store chiave/valore condiviso con TTL (client stile Redis);
+                SESSION_SHARED_URL="local://" usa LocalSharedClient, utile nei test
+"""
+import heapq
+import secrets
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from models import SessionRecord, db
+
+_serializer = TaggedJSONSerializer()
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=0.0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid or new_sid()
+        self.new = new
+        self.expires_at = expires_at
+        self.previous_sid = None
+        self.modified = False
+
+    def regenerate(self):
+        """Cambia l'id di sessione mantenendo i dati (da chiamare quando cambia il livello di accesso)."""
+        if self.previous_sid is None and not self.new:
+            self.previous_sid = self.sid
+        self.sid = new_sid()
+        self.modified = True
+
+
+# -----------------------------
+# Backends
+# -----------------------------
+
+class MemorySessionStore:
+    """Store in processo; le sessioni scadute vengono rimosse tramite un heap ordinato per scadenza."""
+
+    def __init__(self):
+        self._data = {}  # sid -> (payload, user_id, expires_at)
+        self._expiry = []  # heap di (expires_at, sid)
+        self._lock = threading.Lock()
+
+    def load(self, sid, now):
+        entry = self._data.get(sid)
+        if entry is None or entry[2] <= now:
+            return None
+        return entry[0], entry[2]
+
+    def save(self, sid, payload, user_id, expires_at):
+        with self._lock:
+            self._data[sid] = (payload, user_id, expires_at)
+            heapq.heappush(self._expiry, (expires_at, sid))
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            sids = [sid for sid, entry in self._data.items() if entry[1] == user_id]
+            for sid in sids:
+                del self._data[sid]
+        return len(sids)
+
+    def count_active(self, now):
+        return sum(1 for entry in list(self._data.values()) if entry[2] > now)
+
+    def count_active_users(self, now):
+        return len({entry[1] for entry in list(self._data.values()) if entry[2] > now and entry[1] is not None})
+
+    def sweep(self, now):
+        removed = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, sid = heapq.heappop(self._expiry)
+                entry = self._data.get(sid)
+                # l'heap può contenere scadenze superate da un rinnovo successivo
+                if entry is not None and entry[2] == expires_at:
+                    del self._data[sid]
+                    removed += 1
+        return removed
+
+    maybe_sweep = sweep  # l'heap rende la pulizia O(k log n): si può fare ad ogni salvataggio
+
+
+class SQLiteSessionStore:
+    """
+    Store sulla tabella SessionRecord. Usa connessioni Core separate dalla db.session
+    delle route, così salvare la sessione non fa commit di modifiche altrui.
+    """
+
+    def __init__(self, sweep_interval=60):
+        self.table = SessionRecord.__table__
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+
+    def load(self, sid, now):
+        t = self.table
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                db.select(t.c.data, t.c.expires_at).where(t.c.sid == sid, t.c.expires_at > now)
+            ).first()
+        return (row.data, row.expires_at) if row else None
+
+    def save(self, sid, payload, user_id, expires_at):
+        t = self.table
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                t.update().where(t.c.sid == sid).values(data=payload, user_id=user_id, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                conn.execute(t.insert().values(sid=sid, data=payload, user_id=user_id, expires_at=expires_at))
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.sid == sid))
+
+    def delete_user(self, user_id):
+        with db.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(self.table.c.user_id == user_id)).rowcount
+
+    def count_active(self, now):
+        t = self.table
+        with db.engine.connect() as conn:
+            return conn.execute(db.select(db.func.count()).where(t.c.expires_at > now)).scalar()
+
+    def count_active_users(self, now):
+        t = self.table
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.select(db.func.count(db.distinct(t.c.user_id))).where(t.c.expires_at > now)
+            ).scalar()
+
+    def sweep(self, now):
+        # range delete sull'indice di expires_at
+        with db.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(self.table.c.expires_at <= now)).rowcount
+
+    def maybe_sweep(self, now):
+        if now - self._last_sweep < self.sweep_interval:
+            return 0
+        self._last_sweep = now
+        return self.sweep(now)
+
+
+class LocalSharedClient:
+    """
+    Sostituto in processo di un client Redis: implementa solo i comandi usati
+    da SharedSessionStore (get/set con ex, delete, sadd/srem/smembers, scan_iter).
+    """
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at | None)
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            self._data.pop(key, None)
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._alive(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for k in keys if self._data.pop(k, None) is not None)
+
+    def sadd(self, key, *members):
+        with self._lock:
+            entry = self._alive(key)
+            members_set = entry[0] if entry else set()
+            members_set.update(members)
+            self._data[key] = (members_set, None)
+
+    def srem(self, key, *members):
+        with self._lock:
+            entry = self._alive(key)
+            if entry:
+                entry[0].difference_update(members)
+
+    def smembers(self, key):
+        with self._lock:
+            entry = self._alive(key)
+            return set(entry[0]) if entry else set()
+
+    def scan_iter(self, match="*"):
+        prefix = match.rstrip("*")
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix) and self._alive(k)]
+        return iter(keys)
+
+
+class SharedSessionStore:
+    """Store su chiave/valore condiviso: la scadenza è il TTL della chiave, quindi niente sweep."""
+
+    def __init__(self, client, prefix="bank:session:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, sid):
+        return f"{self.prefix}s:{sid}"
+
+    def _user_key(self, user_id):
+        return f"{self.prefix}u:{user_id}"
+
+    def load(self, sid, now):
+        raw = self.client.get(self._key(sid))
+        if raw is None:
+            return None
+        # il valore è "<expires_at>|<payload>" per conoscere la scadenza senza un secondo comando
+        expires_at, _, payload = raw.partition(b"|")
+        return payload, float(expires_at)
+
+    def save(self, sid, payload, user_id, expires_at):
+        ttl = max(1, int(expires_at - time.time()))
+        self.client.set(self._key(sid), f"{expires_at}|".encode() + payload, ex=ttl)
+        if user_id is not None:
+            self.client.sadd(self._user_key(user_id), sid)
+
+    def delete(self, sid):
+        self.client.delete(self._key(sid))
+
+    def delete_user(self, user_id):
+        sids = self.client.smembers(self._user_key(user_id))
+        keys = [self._key(s.decode() if isinstance(s, bytes) else s) for s in sids]
+        removed = self.client.delete(*keys) if keys else 0
+        self.client.delete(self._user_key(user_id))
+        return removed
+
+    def count_active(self, now):
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.prefix}s:*"))
+
+    def count_active_users(self, now):
+        count = 0
+        for user_key in self.client.scan_iter(match=f"{self.prefix}u:*"):
+            sids = self.client.smembers(user_key)
+            if any(self.client.get(self._key(s.decode() if isinstance(s, bytes) else s)) for s in sids):
+                count += 1
+        return count
+
+    def sweep(self, now):
+        return 0
+
+    maybe_sweep = sweep
+
+
+# -----------------------------
+# Session interface
+# -----------------------------
+
+class ServerSessionInterface(SessionInterface):
+    session_class = ServerSession
+    salt = "server-session"
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        now = time.time()
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                found = self.store.load(sid, now)
+                if found is not None:
+                    payload, expires_at = found
+                    return self.session_class(_serializer.loads(payload.decode()), sid=sid, expires_at=expires_at)
+        # sid sconosciuto o scaduto: mai riutilizzare un id fornito dal client
+        return self.session_class(new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add("Cookie")
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        # rinnova la scadenza solo oltre metà vita: la maggior parte delle richieste non scrive
+        refresh = session.expires_at - now < lifetime / 2
+        if not (session.modified or session.new or refresh):
+            return
+
+        expires_at = now + lifetime
+        self.store.save(session.sid, _serializer.dumps(dict(session)).encode(), session.get("user_id"), expires_at)
+        self.store.maybe_sweep(now)
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add("Cookie")
+
+
+def create_store(app):
+    backend = app.config.get("SESSION_BACKEND", "sqlite")
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(sweep_interval=app.config.get("SESSION_SWEEP_INTERVAL", 60))
+    if backend == "shared":
+        url = app.config.get("SESSION_SHARED_URL", "local://")
+        if url.startswith("local://"):
+            client = LocalSharedClient()
+        else:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("SESSION_BACKEND='shared' richiede il pacchetto redis") from e
+            client = redis.Redis.from_url(url)
+        return SharedSessionStore(client)
+    raise ValueError('SESSION_BACKEND deve essere "memory", "sqlite" o "shared"')
+
+
+def init_app(app):
+    """Sostituisce le sessioni su cookie firmato con lo store lato server configurato."""
+    store = create_store(app)
+    app.session_interface = ServerSessionInterface(store)
+    app.extensions["session_store"] = store
+    return store
+
+
+def get_store(app):
+    return app.extensions["session_store"]
+
+
+def revoke_user_sessions(app, user_id):
+    """Invalida tutte le sessioni attive di un utente (es. dopo un reset password)."""
+    return get_store(app).delete_user(user_id)
+
+
+def count_active_users(app):
+    return get_store(app).count_active_users(time.time())
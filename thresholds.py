@@ -0,0 +1,80 @@
+"""
+thresholds.py — soglie di prezzo valutate ad ogni tick, condivise da avvisi
+(alerts.py) e ordini limit (trading.py).
+
+ThresholdBook tiene gli elementi di un simbolo in due liste ordinate:
+    - "rising" per soglia crescente: con prezzo p scattano quelli con soglia <= p
+    - "falling" per soglia decrescente: scattano quelli con soglia >= p
+In entrambi i casi gli elementi raggiunti sono un prefisso della lista (bisect),
+quindi un tick costa O(log n + k) anche con moltissime soglie attive. La
+rimozione è pigra: la chiave resta nella lista e viene saltata all'estrazione.
+
+claim_chunks fa la transizione di stato (active -> triggered, open -> filled) con
+UPDATE condizionati ... RETURNING: se più worker ricevono lo stesso tick, ogni id
+viene preso da uno solo.
+"""
+from bisect import bisect_right, insort
+
+CLAIM_CHUNK = 500  # id per statement, sotto il limite di parametri di SQLite
+
+
+class ThresholdBook:
+    def __init__(self):
+        self.rising = []   # (threshold, item_id)
+        self.falling = []  # (-threshold, item_id)
+        self.items = {}    # item_id -> elemento ritornato da pop_crossed
+
+    def add(self, item_id, threshold, rising, item):
+        self.items[item_id] = item
+        if rising:
+            insort(self.rising, (threshold, item_id))
+        else:
+            insort(self.falling, (-threshold, item_id))
+
+    def extend(self, entries):
+        """Caricamento in blocco di (item_id, threshold, rising, item): append + un solo sort, salta gli id già presenti."""
+        for item_id, threshold, rising, item in entries:
+            if item_id in self.items:
+                continue
+            self.items[item_id] = item
+            if rising:
+                self.rising.append((threshold, item_id))
+            else:
+                self.falling.append((-threshold, item_id))
+        self.rising.sort()
+        self.falling.sort()
+
+    def discard(self, item_id):
+        return self.items.pop(item_id, None)
+
+    def pop_crossed(self, price):
+        """Rimuove e ritorna, in ordine di id, gli elementi raggiunti dal prezzo."""
+        k_rising = bisect_right(self.rising, (price, float("inf")))
+        k_falling = bisect_right(self.falling, (-price, float("inf")))
+        keys = self.rising[:k_rising] + self.falling[:k_falling]
+        del self.rising[:k_rising]
+        del self.falling[:k_falling]
+        crossed = []
+        for item_id in sorted(item_id for _, item_id in keys):
+            item = self.items.pop(item_id, None)
+            if item is not None:
+                crossed.append(item)
+        return crossed
+
+    def __len__(self):
+        return len(self.items)
+
+
+def claim_chunks(conn, table, ids, condition, **values):
+    """
+    UPDATE table SET values WHERE id IN (...) AND condition RETURNING id, a blocchi di
+    CLAIM_CHUNK id; per ogni blocco produce la lista degli id presi da questa transazione.
+    """
+    for i in range(0, len(ids), CLAIM_CHUNK):
+        chunk = ids[i:i + CLAIM_CHUNK]
+        yield conn.execute(
+            table.update()
+            .where(table.c.id.in_(chunk), condition)
+            .values(**values)
+            .returning(table.c.id)
+        ).scalars().all()
@@ -0,0 +1,309 @@
+"""
+trading.py — esecuzione degli ordini crypto con regolamento sul conto.
+
+- Ordini "market": eseguiti subito all'ultimo prezzo del PriceFeed (market.py),
+  senza chiamare CoinGecko sul percorso della richiesta se il prezzo è recente.
+- Ordini "limit": restano nel book in memoria, un ThresholdBook (thresholds.py)
+  per simbolo. Ad ogni tick i buy con limite >= prezzo e i sell con limite <= prezzo
+  si trovano con bisect (O(log n + k)) e si regolano tutti nella stessa transazione.
+- Regolamento atomico: lo stato dell'ordine passa da "open" a "filled" con un
+  UPDATE condizionato (un ordine non può essere eseguito due volte, neanche da due
+  worker), poi addebito/accredito del saldo, CryptoTrade e movimento in Transaction.
+
+I prezzi sono in USD e vengono convertiti nella valuta del conto con fx.rate_table.
+Il book si allinea agli ordini aperti da altri worker leggendo solo gli id
+successivi all'ultimo visto, con una query per tick.
+"""
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from fx import rate_table
+from market import get_feed, latest_price
+from models import CryptoOrder, CryptoTrade, Transaction, User, db
+from prices import PriceError, get_crypto_price
+from thresholds import ThresholdBook, claim_chunks
+
+BUY = "buy"
+SELL = "sell"
+MARKET = "market"
+LIMIT = "limit"
+
+OPEN = "open"
+FILLED = "filled"
+CANCELLED = "cancelled"
+REJECTED = "rejected"
+
+PRICE_CURRENCY = "USD"
+
+
+class TradeError(Exception):
+    pass
+
+
+class RestingOrder:
+    __slots__ = ("order_id", "user_id", "symbol", "side", "quantity", "limit_price", "currency")
+
+    def __init__(self, order_id, user_id, symbol, side, quantity, limit_price, currency):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.quantity = quantity
+        self.limit_price = limit_price
+        self.currency = currency
+
+
+class OrderBook:
+    def __init__(self):
+        self.books = {}
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def _book(self, symbol):
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = ThresholdBook()
+        return book
+
+    @staticmethod
+    def _entry(order):
+        # sell eseguibili a prezzo >= limite (soglia "rising"), buy a prezzo <= limite
+        return order.order_id, order.limit_price, order.side == SELL, order
+
+    def sync(self):
+        """Aggiunge gli ordini limit aperti con id successivo all'ultimo visto (anche da altri worker)."""
+        orders = CryptoOrder.__table__
+        users = User.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(orders.c.id, orders.c.user_id, orders.c.symbol, orders.c.side,
+                          orders.c.quantity, orders.c.limit_price, users.c.currency)
+                .join(users, users.c.id == orders.c.user_id)
+                .where(orders.c.id > self.last_id, orders.c.status == OPEN, orders.c.order_type == LIMIT)
+                .order_by(orders.c.id)
+            ).all()
+        by_symbol = {}
+        for row in rows:
+            by_symbol.setdefault(row.symbol, []).append(self._entry(RestingOrder(*row)))
+        # extend salta gli ordini già aggiunti da place_order in questo worker
+        for symbol, entries in by_symbol.items():
+            self._book(symbol).extend(entries)
+        if rows:
+            self.last_id = rows[-1].id
+        return len(rows)
+
+    def add(self, order):
+        with self._lock:
+            self._book(order.symbol).add(*self._entry(order))
+
+    def discard(self, symbol, order_id):
+        with self._lock:
+            book = self.books.get(symbol)
+            if book is not None:
+                book.discard(order_id)
+
+    def on_tick(self, symbol, price, timestamp):
+        """Listener del PriceFeed: esegue in blocco tutti i limit raggiunti dal prezzo."""
+        with self._lock:
+            self.sync()
+            book = self.books.get(symbol)
+            triggered = book.pop_crossed(price) if book else []
+        if not triggered:
+            return []
+        with db.engine.begin() as conn:
+            results = settle(conn, triggered, price, timestamp)
+        current_app.logger.info("Tick %s @ %.2f: %d ordini limit regolati", symbol, price, len(results))
+        return results
+
+    def open_count(self):
+        return sum(len(book) for book in self.books.values())
+
+
+# -----------------------------
+# Regolamento
+# -----------------------------
+
+def _claim(conn, order_ids, price, now):
+    """open -> filled per gli ordini ancora aperti; ritorna gli id effettivamente presi."""
+    orders = CryptoOrder.__table__
+    claimed = set()
+    for ids in claim_chunks(conn, orders, order_ids, orders.c.status == OPEN,
+                            status=FILLED, filled_at=now, fill_price=price):
+        claimed.update(ids)
+    return claimed
+
+
+def settle(conn, batch, price, now=None):
+    """
+    Esegue una lista di RestingOrder al prezzo USD dato, dentro la transazione di conn.
+
+    Il numero di statement non dipende dal numero di ordini: claim in blocco,
+    saldi e posizioni letti una volta (con lock di riga dove il database lo supporta),
+    conti progressivi in memoria nell'ordine degli id, poi scritture executemany.
+    Ritorna [(order_id, stato, motivo)].
+    """
+    if not batch:
+        return []
+    now = now or datetime.now()
+    batch = sorted(batch, key=lambda o: o.order_id)
+    orders = CryptoOrder.__table__
+    users = User.__table__
+    trades = CryptoTrade.__table__
+
+    claimed = _claim(conn, [o.order_id for o in batch], price, now)
+    user_ids = {o.user_id for o in batch if o.order_id in claimed}
+    if not user_ids:
+        return [(o.order_id, None, "già chiuso") for o in batch]
+
+    balances = dict(conn.execute(
+        db.select(users.c.id, users.c.balance).where(users.c.id.in_(user_ids)).with_for_update()
+    ).all())
+    opening = dict(balances)
+    signed = db.case((trades.c.side == BUY, trades.c.amount), else_=-trades.c.amount)
+    # solo i trade nati da un ordine: le righe del vecchio form non hanno mai mosso il saldo
+    positions = {(uid, symbol): qty for uid, symbol, qty in conn.execute(
+        db.select(trades.c.user_id, trades.c.symbol, db.func.sum(signed))
+        .where(trades.c.user_id.in_(user_ids), trades.c.symbol.in_({o.symbol for o in batch}),
+               trades.c.order_id.isnot(None))
+        .group_by(trades.c.user_id, trades.c.symbol)
+    )}
+
+    results, rejected, trade_rows, tx_rows = [], [], [], []
+    for order in batch:
+        if order.order_id not in claimed:
+            results.append((order.order_id, None, "già chiuso"))
+            continue
+        try:
+            value = round(order.quantity * price * rate_table.rate(PRICE_CURRENCY, order.currency), 2)
+        except PriceError:
+            value, reason = None, "cambio non disponibile"
+        key = (order.user_id, order.symbol)
+        held = positions.get(key, 0.0)
+        if value is None:
+            pass
+        elif order.side == BUY and balances[order.user_id] < value:
+            reason = "fondi insufficienti"
+        elif order.side == SELL and held < order.quantity - 1e-12:
+            reason = "quantità insufficiente"
+        else:
+            reason = None
+        if reason:
+            rejected.append({"_id": order.order_id, "_reason": reason})
+            results.append((order.order_id, REJECTED, reason))
+            continue
+
+        amount = -value if order.side == BUY else value
+        balances[order.user_id] = round(balances[order.user_id] + amount, 2)
+        positions[key] = held + (order.quantity if order.side == BUY else -order.quantity)
+        trade_rows.append({
+            "user_id": order.user_id, "symbol": order.symbol, "side": order.side, "amount": order.quantity,
+            "price": price, "timestamp": now, "order_id": order.order_id,
+        })
+        tx_rows.append({
+            "amount": amount,
+            "timestamp": now,
+            "type": "crypto",
+            "category": "acquisto crypto" if order.side == BUY else "vendita crypto",
+            "user_id": order.user_id,
+            "balance_after": balances[order.user_id],
+            "details": f"{order.side} {order.quantity:g} {order.symbol} @ {price:,.2f} {PRICE_CURRENCY}",
+        })
+        results.append((order.order_id, FILLED, None))
+
+    if rejected:
+        conn.execute(
+            orders.update().where(orders.c.id == db.bindparam("_id"))
+            .values(status=REJECTED, reason=db.bindparam("_reason"), filled_at=None, fill_price=None),
+            rejected,
+        )
+    deltas = [{"_id": uid, "_delta": balances[uid] - opening[uid]} for uid in balances if balances[uid] != opening[uid]]
+    if deltas:
+        # delta e non valore assoluto: non sovrascrive movimenti di altre transazioni
+        conn.execute(
+            users.update().where(users.c.id == db.bindparam("_id"))
+            .values(balance=users.c.balance + db.bindparam("_delta")),
+            deltas,
+        )
+    if trade_rows:
+        conn.execute(trades.insert(), trade_rows)
+        conn.execute(Transaction.__table__.insert(), tx_rows)
+    return results
+
+
+# -----------------------------
+# API usata dalle route
+# -----------------------------
+
+def current_price(symbol):
+    """Ultimo prezzo recente; se manca, una sola chiamata a CoinGecko che diventa un tick."""
+    feed = get_feed(current_app)
+    price = latest_price(feed, symbol, current_app.config.get("MARKET_PRICE_MAX_AGE", 60))
+    if price is None:
+        price = get_crypto_price(symbol)
+        feed.publish(symbol, price, logger=current_app.logger)
+    return price
+
+
+def place_order(user, symbol, side, quantity, order_type=MARKET, limit_price=None):
+    """
+    Registra un ordine e, se è market (o un limit già eseguibile), lo regola subito.
+    Ritorna il CryptoOrder aggiornato.
+    """
+    if side not in (BUY, SELL):
+        raise TradeError("Operazione non valida")
+    if order_type not in (MARKET, LIMIT):
+        raise TradeError("Tipo di ordine non valido")
+    if quantity <= 0:
+        raise TradeError("La quantità deve essere positiva")
+    if order_type == LIMIT and (limit_price is None or limit_price <= 0):
+        raise TradeError("Prezzo limite non valido")
+
+    price = current_price(symbol) if order_type == MARKET else \
+        get_feed(current_app).latest(symbol, current_app.config.get("MARKET_PRICE_MAX_AGE", 60))
+    if order_type == MARKET:
+        limit_price = None
+
+    crosses = price is not None and (
+        order_type == MARKET
+        or (side == BUY and price <= limit_price)
+        or (side == SELL and price >= limit_price)
+    )
+    # inserimento e regolamento nella stessa transazione: se settle fallisce non resta
+    # un ordine market "open" che nessun tick eseguirà mai
+    with db.engine.begin() as conn:
+        order_id = conn.execute(CryptoOrder.__table__.insert().values(
+            user_id=user.id, symbol=symbol, side=side, order_type=order_type, quantity=quantity,
+            limit_price=limit_price, status=OPEN, created_at=datetime.now(),
+        )).inserted_primary_key[0]
+        resting = RestingOrder(order_id, user.id, symbol, side, quantity, limit_price, user.currency)
+        if crosses:
+            settle(conn, [resting], price)
+    if not crosses:
+        get_book(current_app).add(resting)
+
+    return db.session.get(CryptoOrder, order_id)
+
+
+def cancel_order(order):
+    """Annulla un ordine ancora aperto; False se nel frattempo è stato eseguito."""
+    orders = CryptoOrder.__table__
+    with db.engine.begin() as conn:
+        cancelled = conn.execute(
+            orders.update().where(orders.c.id == order.id, orders.c.status == OPEN).values(status=CANCELLED)
+        ).rowcount
+    get_book(current_app).discard(order.symbol, order.id)
+    db.session.refresh(order)
+    return bool(cancelled)
+
+
+def init_app(app):
+    book = OrderBook()
+    app.extensions["order_book"] = book
+    get_feed(app).subscribe(book.on_tick)
+    return book
+
+
+def get_book(app):
+    return app.extensions["order_book"]
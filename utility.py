@@ -1,12 +1,13 @@
 # utility.py
-import requests
+# requests, smtplib ed email vengono importati dentro le funzioni che li usano:
+# costano decine di ms all'avvio e servono solo al primo invio mail / chiamata HTTP.
 from models import User, Card, db
 from flask import session, url_for, current_app as app
 from datetime import datetime, timedelta
-import smtplib
-from email.mime.text import MIMEText
+import hmac
 import random
 import string
+import time
 
 CRYPTO_MAP = {
     "BTC": "bitcoin",
@@ -17,9 +18,6 @@ CRYPTO_MAP = {
 def generate_iban():
     # structure Italian IBAN:
     # IT (2) + CC (2) + CIN (1) + ABI (5) + CAB (5) + Conto (12)
-    country_code = 'IT'
-    control_digits = ''  # to be calculated
-    
     cin = random.choice(string.digits)
     abi = ''.join(random.choice(string.digits) for _ in range(5))
     cab = ''.join(random.choice(string.digits) for _ in range(5))
@@ -28,6 +26,12 @@ def generate_iban():
 
     iban_string = f"{cin}{abi}{cab}{account_number}"
 
+    return make_iban(iban_string)
+
+
+def make_iban(iban_string):
+    """IBAN italiano da CIN+ABI+CAB+conto: aggiunge IT e le cifre di controllo (mod 97)."""
+    country_code = 'IT'
     numeric_string = f"{iban_string}182900"
     
     numeric_string = ''.join([str(int(c, 36)) if c.isalpha() else c for c in numeric_string])
@@ -39,23 +43,73 @@ def generate_iban():
     return f"{country_code}{control_digits}{iban_string}"
 
 
-def send_otp(email):
-    otp = str(random.randint(100000, 999999))
-    session["otp"] = otp
-    # Access the app configuration to get the email credentials
-    from flask import current_app as app
+def change_balance(user_id, delta, conn=None):
+    """
+    Movimento sul saldo con un UPDATE atomico (balance = balance + delta) nella
+    transazione corrente (sessione ORM o connessione Core). Ritorna il nuovo saldo,
+    oppure None se un addebito lo porterebbe sotto zero.
+    Il saldo non va mai riscritto come valore assoluto letto in precedenza: si
+    perderebbero gli addebiti concorrenti (pagamenti carta, ordini crypto eseguiti dal poller).
+    """
+    users = User.__table__
+    query = users.update().where(users.c.id == user_id) \
+        .values(balance=users.c.balance + delta).returning(users.c.balance)
+    if delta < 0:
+        query = query.where(users.c.balance >= -delta)
+    return (conn or db.session).execute(query).scalar()
+
+
+def send_mail(to, subject, body):
+    """Invia una mail di testo tramite SMTP Gmail con le credenziali della config."""
+    import smtplib
+    from email.mime.text import MIMEText
+
     EMAIL_USER = app.config['EMAIL_USER']
     EMAIL_PASS = app.config['EMAIL_PASS']
 
-    msg = MIMEText(f"Il tuo codice OTP è: {otp}", "plain", "utf-8")
-    msg["Subject"] = "Codice OTP"
+    msg = MIMEText(body, "plain", "utf-8")
+    msg["Subject"] = subject
     msg["From"] = EMAIL_USER
-    msg["To"] = email
+    msg["To"] = to
 
     with smtplib.SMTP("smtp.gmail.com", 587) as server:
         server.starttls()
         server.login(EMAIL_USER, EMAIL_PASS)
-        server.sendmail(EMAIL_USER, email, msg.as_string())
+        server.sendmail(EMAIL_USER, [to], msg.as_string())
+
+
+def send_otp(email):
+    otp = str(random.randint(100000, 999999))
+    # la sessione è lato server (sessions.py): il codice non finisce mai nel cookie
+    session["otp"] = {
+        "code": otp,
+        "expires": time.time() + app.config.get("OTP_TTL_SECONDS", 300),
+        "attempts": 0,
+    }
+    send_mail(email, "Codice OTP", f"Il tuo codice OTP è: {otp}")
+
+
+def check_otp(code):
+    """
+    Verifica il codice OTP della sessione corrente.
+    Ritorna "ok", "invalid" (tentativi rimasti), "expired" o "locked" (troppi tentativi).
+    Negli ultimi due casi l'OTP viene rimosso e bisogna rifare il login.
+    """
+    otp = session.get("otp")
+    if not otp:
+        return "expired"
+    if time.time() > otp["expires"]:
+        session.pop("otp")
+        return "expired"
+    if code and hmac.compare_digest(code, otp["code"]):
+        session.pop("otp")
+        return "ok"
+    attempts = otp["attempts"] + 1
+    if attempts >= app.config.get("OTP_MAX_ATTEMPTS", 3):
+        session.pop("otp")
+        return "locked"
+    session["otp"] = dict(otp, attempts=attempts)
+    return "invalid"
 
 
 def generate_card(user_id):
@@ -74,7 +128,9 @@ def generate_card(user_id):
     expiry_date = today + timedelta(days=5*365)
     expiry = expiry_date.strftime("%m/%y")
 
-    new_card = Card(number=number, cvv=cvv, expiry=expiry, user_id=user_id)
+    # nuova state_version: gli indici carte degli altri worker la caricano al prossimo controllo
+    from cards import next_state_version
+    new_card = Card(number=number, cvv=cvv, expiry=expiry, user_id=user_id, state_version=next_state_version())
     db.session.add(new_card)
     db.session.commit()
 
@@ -118,25 +174,19 @@ def send_security_alert(email, ip=None, user_agent=None, attempts=0, locked_unti
 
         body = "\n".join(body_lines)
 
-        msg = MIMEText(body, "plain", "utf-8")
-        msg["Subject"] = "Sicurezza account: tentativo di accesso rilevato — Sei tu?"
-        msg["From"] = app.config.get('EMAIL_USER')
-        msg["To"] = email
-
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(app.config['EMAIL_USER'], app.config['EMAIL_PASS'])
-            server.sendmail(app.config['EMAIL_USER'], [email], msg.as_string())
+        send_mail(email, "Sicurezza account: tentativo di accesso rilevato — Sei tu?", body)
     except Exception as e:
         # non vogliamo far crashare il login per problemi di mail — logga l'errore
         app.logger.exception("Errore invio security alert: %s", e)
 
 def fetch_crypto_price(symbol="bitcoin", vs="usd"):
+    import requests
     url = f"https://api.coingecko.com/api/v3/simple/price?ids={symbol}&vs_currencies={vs}"
     r = requests.get(url).json()
     return r.get(symbol, {}).get(vs, None)
 
 def get_crypto_price(symbol):
+    import requests
     url = f"https://api.coingecko.com/api/v3/simple/price?ids={symbol}&vs_currencies=usd"
     r = requests.get(url).json()
     return r[symbol]["usd"]
\ No newline at end of file
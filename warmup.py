@@ -0,0 +1,43 @@
+"""
+warmup.py — avvio a freddo più rapido dei worker.
+
+- Cache del bytecode Jinja su disco (FileSystemBytecodeCache), condivisa da tutti
+  i worker: un template viene compilato una sola volta per deploy, non per processo.
+- Comando CLI: `flask --app app precompile-templates` per popolare la cache in fase
+  di deploy: ogni worker poi legge il bytecode invece di compilare.
+- warm_up(app) (template + mapper SQLAlchemy) solo dove il costo si paga una volta:
+  nel master gunicorn con preload, prima del fork. create_app non lo chiama, un worker
+  senza preload caricherebbe tutti i template anche se ne usa due.
+"""
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.orm import configure_mappers
+
+
+def precompile_templates(app):
+    """Compila tutti i template (scrivendo la bytecode cache) e ritorna (numero, secondi)."""
+    start = time.perf_counter()
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names), time.perf_counter() - start
+
+
+def warm_up(app):
+    count, elapsed = precompile_templates(app)
+    configure_mappers()
+    app.logger.info("Warm-up: %d template precompilati in %.1f ms", count, elapsed * 1000)
+
+
+def init_app(app):
+    cache_dir = app.config.get("TEMPLATE_CACHE_DIR") or os.path.join(app.instance_path, "jinja_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    @app.cli.command("precompile-templates")
+    def precompile_templates_command():
+        """Compila tutti i template nella bytecode cache."""
+        count, elapsed = precompile_templates(app)
+        print(f"{count} template compilati in {elapsed * 1000:.1f} ms ({cache_dir})")
@@ -0,0 +1,34 @@
+"""
+wsgi.py — entry point di produzione.
+
+    gunicorn -c gunicorn.conf.py wsgi:app     (Linux: più processi × più thread)
+    python wsgi.py                            (waitress: un processo multi-thread, anche su Windows)
+
+create_app non avvia i thread in background: gunicorn li avvia in ogni worker
+dopo il fork (vedi gunicorn.conf.py), waitress qui sotto.
+"""
+import os
+import signal
+import sys
+
+from app import create_app, init_db, start_background_workers, stop_background_workers
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    from waitress import serve
+
+    init_db(app)
+    start_background_workers(app)
+    # SIGTERM -> SystemExit, così il finally ferma i worker in background
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        serve(
+            app,
+            host=os.environ.get("HOST", "0.0.0.0"),
+            port=int(os.environ.get("PORT", 8000)),
+            threads=int(os.environ.get("WEB_THREADS", (os.cpu_count() or 1) * 4)),
+        )
+    finally:
+        stop_background_workers(app)